@@ -0,0 +1,59 @@
+"""
+Gunicorn configuration of the project, used with
+
+    gunicorn -c power2go_project/gunicorn.conf.py
+
+The application is loaded and warmed up once in the master process, then
+the workers are forked from it: they share its memory and are ready to
+serve as soon as they start.
+"""
+
+import os
+import tempfile
+import time
+
+# The workers write their metrics to this directory so that /metrics, served
+# by any of them, reports those of all of them.
+os.environ.setdefault(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'power2go-metrics')
+)
+
+wsgi_app = 'power2go_project.wsgi:application'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+preload_app = True
+# Workers are recycled after this many requests, at a random point of the
+# jitter so they do not all restart together.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    from user_contracts import metrics
+    from user_contracts.warmup import warm_up
+
+    metrics.reset()
+    timings = warm_up()
+    server.log.info(
+        'Warmed up in %.3fs (%s).',
+        sum(timings.values()),
+        ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in timings.items()),
+    )
+
+
+def pre_fork(server, worker):
+    # Runs in the master for every worker, including those replacing
+    # recycled workers, so each worker measures from its own fork.
+    worker.forked_at = time.time()
+
+
+def post_fork(server, worker):
+    from user_contracts.warmup import after_fork
+
+    after_fork(worker.forked_at)
+
+
+def child_exit(server, worker):
+    from user_contracts import metrics
+
+    metrics.mark_process_dead(worker.pid)
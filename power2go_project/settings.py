@@ -67,9 +67,138 @@ GRAPHENE = {
     "SCHEMA": "user_contracts.api.schema.schema",
     "MIDDLEWARE": [
         "graphql_jwt.middleware.JSONWebTokenMiddleware",
+        "user_contracts.api.middleware.MetricsMiddleware",
     ],
 }
 
+# Share of GraphQL operations whose field timings are exported at /metrics,
+# together with the per-operation latency and SQL counts.
+GRAPHQL_FIELD_TIMING_SAMPLE_RATE = env.float(
+    "GRAPHQL_FIELD_TIMING_SAMPLE_RATE", default=0.01
+)
+
+# With several worker processes, each writes its metrics to a file of
+# METRICS_DIR every METRICS_FLUSH_INTERVAL seconds, and /metrics
+# merges the files of all of them. Empty, /metrics only reports the metrics
+# of the process serving it. The gunicorn config sets a default.
+METRICS_DIR = env("METRICS_DIR", default="")
+METRICS_FLUSH_INTERVAL = env.float("METRICS_FLUSH_INTERVAL", default=5)
+
+# Operations slower than the threshold, plus a sampled share of the others,
+# are written as JSON lines to the slow-operation log.
+GRAPHQL_SLOW_OPERATION_MS = env.int("GRAPHQL_SLOW_OPERATION_MS", default=500)
+GRAPHQL_SLOW_LOG_SAMPLE_RATE = env.float("GRAPHQL_SLOW_LOG_SAMPLE_RATE", default=0.001)
+GRAPHQL_SLOW_LOG_FILE = env(
+    "GRAPHQL_SLOW_LOG_FILE", default=os.path.join(BASE_DIR, "slow_operations.log")
+)
+
+# GraphQL responses at least this large are compressed (gzip, or brotli
+# when installed) for the clients that accept it.
+GRAPHQL_COMPRESSION_MIN_BYTES = env.int("GRAPHQL_COMPRESSION_MIN_BYTES", default=1024)
+
+# Seconds clients and proxies may reuse the response of a GET query before
+# revalidating it with its ETag.
+GRAPHQL_GET_MAX_AGE = env.int("GRAPHQL_GET_MAX_AGE", default=5)
+
+# Operations allowed in a batched request (a POST of a JSON array), and how
+# many of them may run at the same time when they are all queries.
+GRAPHQL_BATCH_MAX_OPERATIONS = env.int("GRAPHQL_BATCH_MAX_OPERATIONS", default=20)
+GRAPHQL_BATCH_CONCURRENCY = env.int("GRAPHQL_BATCH_CONCURRENCY", default=1)
+
+# Admission control of the GraphQL endpoint. Every client (JWT user, else
+# address) has a token bucket refilled at GRAPHQL_RATE_LIMIT_RATE cost units
+# per second up to GRAPHQL_RATE_LIMIT_BURST, kept in memory ("local") or in
+# the Django cache ("cache"). Requests beyond GRAPHQL_MAX_CONCURRENT_REQUESTS
+# in flight are rejected, counted per process ("local") or in the Django
+# cache ("cache") with GRAPHQL_CONCURRENCY_BACKEND. Local limits apply to
+# each worker process separately: with N workers a client gets N times the
+# rate, and sync workers never run two requests at once. 0 disables either
+# limit.
+GRAPHQL_RATE_LIMIT_RATE = env.float("GRAPHQL_RATE_LIMIT_RATE", default=100)
+GRAPHQL_RATE_LIMIT_BURST = env.int("GRAPHQL_RATE_LIMIT_BURST", default=1000)
+GRAPHQL_RATE_LIMIT_BACKEND = env("GRAPHQL_RATE_LIMIT_BACKEND", default="local")
+GRAPHQL_MAX_CONCURRENT_REQUESTS = env.int("GRAPHQL_MAX_CONCURRENT_REQUESTS", default=32)
+GRAPHQL_CONCURRENCY_BACKEND = env("GRAPHQL_CONCURRENCY_BACKEND", default="local")
+
+# Django cache, in the memory of each process by default. Set CACHE_URL to a
+# cache shared by the processes, e.g. rediscache://host:6379/0 or
+# pymemcache://host:11211, so that the entity cache, the archive boundary
+# and the "cache" admission backends are shared and invalidated across them.
+CACHES = {'default': env.cache('CACHE_URL', default='locmemcache://')}
+
+# Users and contracts looked up by id are cached in an in-process LRU of
+# ENTITY_CACHE_LOCAL_SIZE entries kept ENTITY_CACHE_LOCAL_TTL seconds, in
+# front of the Django cache where they are kept ENTITY_CACHE_TTL seconds,
+# when it is shared by the processes.
+ENTITY_CACHE_LOCAL_SIZE = env.int("ENTITY_CACHE_LOCAL_SIZE", default=10000)
+ENTITY_CACHE_LOCAL_TTL = env.float("ENTITY_CACHE_LOCAL_TTL", default=5)
+ENTITY_CACHE_TTL = env.int("ENTITY_CACHE_TTL", default=300)
+
+# Offboarded users have their contracts deleted by chunks of this many
+# contracts, each in its own transaction, pausing this many seconds between
+# chunks.
+OFFBOARDING_CHUNK_SIZE = env.int("OFFBOARDING_CHUNK_SIZE", default=1000)
+OFFBOARDING_CHUNK_PAUSE = env.float("OFFBOARDING_CHUNK_PAUSE", default=0)
+
+# Contract changes are written to an outbox in their transaction and
+# delivered by `manage.py deliver_outbox` as gzipped JSON batches of
+# OUTBOX_BATCH_SIZE events POSTed to OUTBOX_ENDPOINT_URL (with
+# OUTBOX_ENDPOINT_TOKEN as bearer token when set). Refused batches are
+# retried after a delay doubling from OUTBOX_RETRY_BASE_DELAY seconds up to
+# OUTBOX_RETRY_MAX_DELAY.
+OUTBOX_ENDPOINT_URL = env("OUTBOX_ENDPOINT_URL", default="")
+OUTBOX_ENDPOINT_TOKEN = env("OUTBOX_ENDPOINT_TOKEN", default="")
+OUTBOX_BATCH_SIZE = env.int("OUTBOX_BATCH_SIZE", default=500)
+OUTBOX_TIMEOUT = env.float("OUTBOX_TIMEOUT", default=10)
+OUTBOX_RETRY_BASE_DELAY = env.float("OUTBOX_RETRY_BASE_DELAY", default=1)
+OUTBOX_RETRY_MAX_DELAY = env.float("OUTBOX_RETRY_MAX_DELAY", default=300)
+
+# `manage.py archive_contracts` moves the contracts older than this many
+# days to the archive table, read only by the queries asking for a period
+# reaching it.
+CONTRACT_ARCHIVE_AFTER_DAYS = env.int("CONTRACT_ARCHIVE_AFTER_DAYS", default=730)
+
+# Server-sent event streams of the contract changes of a user, served by the
+# ASGI application. "local" only reaches the streams of the process making
+# the change, "postgres" reaches every process through LISTEN/NOTIFY.
+# A stream more than CONTRACT_STREAM_QUEUE_SIZE events behind is closed and
+# resumed by its client; reconnecting clients are replayed at most
+# CONTRACT_STREAM_REPLAY_LIMIT missed events from the outbox, including the
+# events written up to CONTRACT_STREAM_REPLAY_WINDOW seconds before their
+# last one, which may have committed after it.
+CONTRACT_STREAM_BACKEND = env("CONTRACT_STREAM_BACKEND", default="local")
+CONTRACT_STREAM_QUEUE_SIZE = env.int("CONTRACT_STREAM_QUEUE_SIZE", default=100)
+CONTRACT_STREAM_KEEPALIVE = env.float("CONTRACT_STREAM_KEEPALIVE", default=15)
+CONTRACT_STREAM_MAX_CONNECTIONS = env.int("CONTRACT_STREAM_MAX_CONNECTIONS", default=10000)
+CONTRACT_STREAM_REPLAY_LIMIT = env.int("CONTRACT_STREAM_REPLAY_LIMIT", default=1000)
+CONTRACT_STREAM_REPLAY_WINDOW = env.float("CONTRACT_STREAM_REPLAY_WINDOW", default=60)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "message": {"format": "%(message)s"},
+    },
+    "handlers": {
+        "slow_operations": {
+            # Every worker process appends to the file, which is rotated by
+            # an external tool such as logrotate: the handler reopens it once
+            # it was moved.
+            "class": "logging.handlers.WatchedFileHandler",
+            "filename": GRAPHQL_SLOW_LOG_FILE,
+            "delay": True,
+            "formatter": "message",
+        },
+    },
+    "loggers": {
+        "user_contracts.slow_operations": {
+            "handlers": ["slow_operations"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
 AUTHENTICATION_BACKENDS = [
     "graphql_jwt.backends.JSONWebTokenBackend",
     "django.contrib.auth.backends.ModelBackend",
@@ -113,8 +242,15 @@ WSGI_APPLICATION = 'power2go_project.wsgi.application'
 DATABASE_URL = env('DATABASE_URL', default=None)
 
 if DATABASE_URL:
+    # Each thread serving requests or the operations of batches keeps its
+    # connection open for DATABASE_CONN_MAX_AGE seconds, so the next ones
+    # reuse it after a health check. 0 closes it after every request.
     DATABASES = {
-        'default': dj_database_url.parse(DATABASE_URL)
+        'default': dj_database_url.parse(
+            DATABASE_URL,
+            conn_max_age=env.int('DATABASE_CONN_MAX_AGE', default=0),
+            conn_health_checks=True,
+        )
     }
 else:
     print("Postgres URL not found, using sqlite instead")
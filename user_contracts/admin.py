@@ -1,5 +1,141 @@
+import json
+from decimal import Decimal
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+from django.utils.text import smart_split, unescape_string_literal
+from . import changes
 from .models import Contract
 
-# Register your models here.
-admin.site.register(Contract)
+# Below this many rows an exact COUNT(*) is cheap enough.
+ESTIMATED_COUNT_THRESHOLD = 100_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator reading the row count of large tables from the Postgres planner
+    statistics instead of running COUNT(*) on every page.
+
+    The count of an unfiltered list comes from `pg_class.reltuples`, the one
+    of a filtered list from the row estimate of its query plan. Other
+    databases, and small tables, get the exact count.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return super().count
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            table_rows = int(row[0]) if row else -1
+            if table_rows < ESTIMATED_COUNT_THRESHOLD:
+                return super().count
+            if not queryset.query.where:
+                return table_rows
+
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+
+
+@admin.register(Contract)
+class ContractAdmin(admin.ModelAdmin):
+    """
+    Contract admin usable on tables of millions of rows: the user of every
+    row is fetched in the same query, the row count is estimated, rows are
+    ordered by primary key and only sortable by indexed columns, and the
+    user is picked by id instead of from a list of every user.
+
+    Contracts are saved and deleted like the mutations do, together with
+    the change hooks of `user_contracts.changes`, so the summaries, the
+    outbox, the version stamps and the caches follow the admin too.
+    """
+
+    list_display = ("id", "description", "user", "created_at", "fidelity", "amount")
+    list_select_related = ("user",)
+    list_per_page = 100
+    ordering = ("-id",)
+    sortable_by = ("id", "created_at")
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    raw_id_fields = ("user",)
+    search_fields = ("description",)
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            if not change:
+                obj.save()
+                changes.contract_created(obj)
+                return
+            # The row is locked, so it cannot be archived before the update.
+            old = Contract.objects.select_for_update().get(pk=obj.pk)
+            obj.save()
+            if old.user_id == obj.user_id:
+                changes.contract_updated(obj, old.amount, old.fidelity)
+            else:
+                # Moved to another user: it leaves the contracts of the first.
+                changes.contract_deleted(old)
+                changes.contract_created(obj)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            contract = Contract.objects.select_for_update().get(pk=obj.pk)
+            # Deleted through a queryset, which keeps the primary key of the
+            # instance for the change hooks.
+            Contract.objects.filter(pk=contract.pk).delete()
+            changes.contract_deleted(contract)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            rows = list(
+                queryset.select_for_update()
+                .order_by("pk")
+                .values_list("pk", "user_id", "amount", "fidelity")
+            )
+            Contract.objects.filter(pk__in=[pk for pk, _, _, _ in rows]).delete()
+            by_user = {}
+            for pk, user_id, amount, fidelity in rows:
+                by_user.setdefault(user_id, []).append((pk, amount, fidelity))
+            for user_id, contracts in by_user.items():
+                changes.contracts_deleted(
+                    user_id,
+                    [pk for pk, _, _ in contracts],
+                    amount=sum(
+                        (Decimal(amount) for _, amount, _ in contracts), Decimal("0")
+                    ),
+                    fidelity=sum(fidelity for _, _, fidelity in contracts),
+                )
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        On Postgres, match every word of the search with ILIKE, which the
+        trigram index of migration 0003 serves. The default search compares
+        UPPER(description), an expression the index does not cover.
+        """
+        if connections[queryset.db].vendor != "postgresql":
+            return super().get_search_results(request, queryset, search_term)
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            pattern = bit.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            queryset = queryset.filter(
+                RawSQL(
+                    f'"{Contract._meta.db_table}"."description" ILIKE %s',
+                    [f"%{pattern}%"],
+                    output_field=BooleanField(),
+                )
+            )
+        return queryset, False
@@ -0,0 +1,318 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+    OperationType,
+    get_operation_ast,
+    parse,
+)
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_http_authorization, get_payload
+from user_contracts.metrics import registry
+
+REQUESTS_SHED = registry.counter(
+    "graphql_requests_shed",
+    "GraphQL requests rejected by the admission control.",
+    ["reason"],
+)
+RATE_LIMITED = "rate_limit"
+OVERLOADED = "concurrency"
+
+# Cost of the root fields returning lists, every field selected below them
+# is counted this many times.
+LIST_FIELDS = {
+    "allUsers": 10,
+    "allContracts": 10,
+    "getContractsByUserId": 5,
+    "searchContracts": 5,
+    "revenueProjection": 20,
+}
+MUTATION_COST = 5
+
+# Idle clients whose bucket is full again are dropped from the local store
+# once it holds this many clients.
+MAX_LOCAL_CLIENTS = 10_000
+
+
+def rate_limit_rate():
+    return getattr(settings, "GRAPHQL_RATE_LIMIT_RATE", 100)
+
+
+def rate_limit_burst():
+    return getattr(settings, "GRAPHQL_RATE_LIMIT_BURST", 1000)
+
+
+def rate_limit_backend():
+    return getattr(settings, "GRAPHQL_RATE_LIMIT_BACKEND", "local")
+
+
+def max_concurrent_requests():
+    return getattr(settings, "GRAPHQL_MAX_CONCURRENT_REQUESTS", 32)
+
+
+def concurrency_backend():
+    return getattr(settings, "GRAPHQL_CONCURRENCY_BACKEND", "local")
+
+
+def _selection_cost(selection_set, fragments, seen):
+    cost = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            cost += 1
+            if selection.selection_set is not None:
+                cost += LIST_FIELDS.get(selection.name.value, 1) * _selection_cost(
+                    selection.selection_set, fragments, seen
+                )
+        elif isinstance(selection, InlineFragmentNode):
+            cost += _selection_cost(selection.selection_set, fragments, seen)
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            if name in fragments and name not in seen:
+                cost += _selection_cost(
+                    fragments[name].selection_set, fragments, seen | {name}
+                )
+    return cost
+
+
+@lru_cache(maxsize=1024)
+def operation_cost(query, operation_name=None):
+    """
+    Estimated cost of an operation: one per selected field, the fields
+    selected below a list field counting once per expected item, plus a
+    fixed cost per mutation. Invalid operations cost 1, the view rejects
+    them anyway.
+    """
+    if not query:
+        return 1
+    try:
+        document = parse(query)
+        operation = get_operation_ast(document, operation_name)
+    except Exception:
+        return 1
+    if operation is None:
+        return 1
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    cost = _selection_cost(operation.selection_set, fragments, frozenset())
+    if operation.operation == OperationType.MUTATION:
+        cost += MUTATION_COST * len(operation.selection_set.selections)
+    return max(cost, 1)
+
+
+def client_key(request):
+    """
+    Key of the bucket charged for a request: the user of a valid JWT, else
+    the address of the client.
+    """
+    token = get_http_authorization(request)
+    if token is not None:
+        try:
+            payload = get_payload(token)
+            username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+        except Exception:
+            username = None
+        if username:
+            return f"user:{username}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class LocalBuckets:
+    """
+    Token buckets held in the memory of the process. Every process has its
+    own, so a client may spend the rate once per process.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst, now):
+        """
+        Take `cost` tokens from the bucket of `key` and return 0, or the
+        seconds to wait for the bucket to hold them.
+        """
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, updated, now, rate, burst)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                return (cost - tokens) / rate
+            self._buckets[key] = (tokens - cost, now)
+            if len(self._buckets) > MAX_LOCAL_CLIENTS:
+                self._prune(now, rate, burst)
+            return 0
+
+    def _prune(self, now, rate, burst):
+        idle = burst / rate
+        self._buckets = {
+            key: value for key, value in self._buckets.items() if now - value[1] < idle
+        }
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    """
+    Token buckets held in the Django cache, shared by the processes using
+    the same cache.
+
+    A bucket is read and written back without a lock, so concurrent
+    requests of a client may each spend the same tokens: the limit is
+    approximate, which is enough to contain a misbehaving client.
+    """
+
+    prefix = "graphql-rate-limit:"
+
+    def take(self, key, cost, rate, burst, now):
+        cache_key = self.prefix + key
+        tokens, updated = cache.get(cache_key, (burst, now))
+        tokens = _refill(tokens, updated, now, rate, burst)
+        timeout = math.ceil(burst / rate) + 1
+        if tokens < cost:
+            cache.set(cache_key, (tokens, now), timeout)
+            return (cost - tokens) / rate
+        cache.set(cache_key, (tokens - cost, now), timeout)
+        return 0
+
+
+BACKENDS = {"local": LocalBuckets(), "cache": CacheBuckets()}
+
+
+def get_buckets():
+    return BACKENDS[rate_limit_backend()]
+
+
+def rejection(reason, retry_after, message):
+    REQUESTS_SHED.inc((reason,))
+    response = JsonResponse({"errors": [{"message": message}]}, status=429)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def check_rate_limit(request, cost):
+    """
+    Charge `cost` to the client of `request` and return a 429 response when
+    its bucket is empty, None when the request may proceed.
+
+    Buckets refill at `GRAPHQL_RATE_LIMIT_RATE` per second up to
+    `GRAPHQL_RATE_LIMIT_BURST`; a rate of 0 disables the limit.
+    """
+    rate, burst = rate_limit_rate(), rate_limit_burst()
+    if rate <= 0:
+        return None
+    wait = get_buckets().take(
+        client_key(request), min(cost, burst), rate, burst, time.time()
+    )
+    if wait:
+        return rejection(RATE_LIMITED, wait, "Rate limit exceeded.")
+    return None
+
+
+class LocalSlots:
+    """
+    Concurrency slots of the process. They only bound anything with
+    threaded workers: a sync worker serves one request at a time.
+    """
+
+    def __init__(self):
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, limit, now):
+        """Take a slot and return what releases it, or None when all are taken."""
+        with self._lock:
+            if limit not in self._semaphores:
+                self._semaphores[limit] = threading.BoundedSemaphore(limit)
+            semaphore = self._semaphores[limit]
+        return semaphore if semaphore.acquire(blocking=False) else None
+
+    def release(self, semaphore):
+        semaphore.release()
+
+
+class CacheSlots:
+    """
+    Concurrency slots counted in the Django cache, shared by the processes
+    using the same cache.
+
+    A request is counted in the window of `window` seconds it started in,
+    and the requests of the current and the previous windows count against
+    the limit. The slots of a worker killed in the middle of a request are
+    so only lost until the window of the request is two windows old, at
+    the cost of not counting the requests running longer than that.
+    """
+
+    prefix = "graphql-in-flight:"
+    window = 60
+
+    def acquire(self, limit, now):
+        current = int(now // self.window)
+        key = f"{self.prefix}{current}"
+        cache.add(key, 0, 2 * self.window + 1)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # Expired since it was added.
+            cache.set(key, 1, 2 * self.window + 1)
+            count = 1
+        count += cache.get(f"{self.prefix}{current - 1}", 0)
+        if count > limit:
+            self.release(key)
+            return None
+        return key
+
+    def release(self, key):
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+
+
+SLOTS = {"local": LocalSlots(), "cache": CacheSlots()}
+
+
+def get_slots():
+    return SLOTS[concurrency_backend()]
+
+
+@contextmanager
+def concurrency_slot():
+    """
+    Hold one of the `GRAPHQL_MAX_CONCURRENT_REQUESTS` slots and yield True,
+    or yield False at once when they are all taken so the request can be
+    shed instead of queueing. A limit of 0 disables it.
+
+    The slots are those of the process, or those shared by all the
+    processes with `GRAPHQL_CONCURRENCY_BACKEND=cache`.
+    """
+    limit = max_concurrent_requests()
+    if limit <= 0:
+        yield True
+        return
+    slots = get_slots()
+    slot = slots.acquire(limit, time.time())
+    if slot is None:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        slots.release(slot)
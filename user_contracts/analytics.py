@@ -0,0 +1,145 @@
+from datetime import date, datetime, time, timezone as dt_timezone
+from decimal import Decimal
+from itertools import chain, islice
+import numpy as np
+from django.core.cache import cache
+from django.db.models.functions import ExtractMonth, ExtractYear
+from user_contracts import versions
+from user_contracts.models import ArchivedContract, Contract
+
+GROUP_BY_MONTH = "month"
+GROUP_BY_USER = "user"
+GROUP_BY_TIER = "tier"
+
+CHUNK_SIZE = 100_000
+MAX_MONTHS = 1200
+CACHE_TIMEOUT = 60 * 60
+
+# Columns of the chunks loaded from the contracts table.
+USER, YEAR, MONTH, FIDELITY, AMOUNT = range(5)
+
+
+def month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def month_start(index):
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def contract_chunks(before_month, chunk_size=CHUNK_SIZE):
+    """
+    Yield the contracts, archived ones included, starting before
+    `before_month` as float64 arrays of shape (n, 5), one row per contract
+    with the columns user id, year and month of creation, fidelity and
+    amount.
+    """
+    before = datetime.combine(month_start(before_month), time(), dt_timezone.utc)
+    # Archived contracts may still bring revenue in the window.
+    rows = chain.from_iterable(
+        model.objects.filter(created_at__lt=before)
+        .annotate(year=ExtractYear("created_at"), month=ExtractMonth("created_at"))
+        .values_list("user_id", "year", "month", "fidelity", "amount")
+        .iterator(chunk_size=chunk_size)
+        for model in (Contract, ArchivedContract)
+    )
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield np.array(chunk, dtype=np.float64)
+
+
+def project_chunk(chunk, first_month, last_month):
+    """
+    Spread the amount of every contract of the chunk evenly over the months
+    of its fidelity term and keep the part falling in the window.
+
+    Returns, per contract, the first and end (exclusive) months of the term
+    inside the window, relative to `first_month`, and the monthly revenue.
+    Contracts outside the window get an empty term.
+    """
+    start = chunk[:, YEAR].astype(np.int64) * 12 + chunk[:, MONTH].astype(np.int64) - 1
+    term = np.maximum(chunk[:, FIDELITY].astype(np.int64), 1)
+    monthly = chunk[:, AMOUNT] / term
+    low = np.clip(start, first_month, last_month + 1) - first_month
+    high = np.clip(start + term, first_month, last_month + 1) - first_month
+    return low, high, monthly
+
+
+def _grouped_totals(keys, totals):
+    """Sum `totals` per distinct value of `keys`."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=totals)
+
+
+def compute_projection(first_month, last_month, group_by, chunk_size=CHUNK_SIZE):
+    """
+    Return the projected revenue of the window as a list of `(key, month,
+    amount)` tuples: one per month of the window when grouping by month,
+    else the total of the window per user or per fidelity term.
+    """
+    months = last_month - first_month + 1
+    curve = np.zeros(months + 1)
+    group_keys, group_totals = [], []
+
+    for chunk in contract_chunks(last_month + 1, chunk_size):
+        low, high, monthly = project_chunk(chunk, first_month, last_month)
+        if group_by == GROUP_BY_MONTH:
+            # Difference array: the revenue starts at `low` and stops at
+            # `high`, the cumulative sum below gives the revenue per month.
+            curve += np.bincount(low, weights=monthly, minlength=months + 1)
+            curve -= np.bincount(high, weights=monthly, minlength=months + 1)
+        else:
+            column = USER if group_by == GROUP_BY_USER else FIDELITY
+            keys, totals = _grouped_totals(chunk[:, column], monthly * (high - low))
+            group_keys.append(keys)
+            group_totals.append(totals)
+
+    if group_by == GROUP_BY_MONTH:
+        amounts = np.cumsum(curve)[:months]
+        return [
+            (
+                month_start(first_month + offset).strftime("%Y-%m"),
+                month_start(first_month + offset),
+                _to_decimal(amount),
+            )
+            for offset, amount in enumerate(amounts)
+        ]
+
+    if not group_keys:
+        return []
+    keys, totals = _grouped_totals(
+        np.concatenate(group_keys), np.concatenate(group_totals)
+    )
+    return [
+        (str(int(key)), None, _to_decimal(total))
+        for key, total in zip(keys, totals)
+        if total
+    ]
+
+
+def _to_decimal(value):
+    return Decimal(f"{value:.2f}")
+
+
+def revenue_projection(date_from, date_to, group_by=GROUP_BY_MONTH):
+    """
+    Projected revenue between the months of `date_from` and `date_to`.
+
+    Results are cached until the next contract change, which bumps the
+    contracts data version the cache key is made of.
+    """
+    first_month, last_month = month_index(date_from), month_index(date_to)
+    if last_month < first_month:
+        raise ValueError("The end of the projection is before its start.")
+    if last_month - first_month >= MAX_MONTHS:
+        raise ValueError(f"A projection covers at most {MAX_MONTHS} months.")
+
+    version = versions.current_versions().get(versions.CONTRACTS, 0)
+    key = f"revenue-projection:{version}:{first_month}:{last_month}:{group_by}"
+    projection = cache.get(key)
+    if projection is None:
+        projection = compute_projection(first_month, last_month, group_by)
+        cache.set(key, projection, CACHE_TIMEOUT)
+    return projection
@@ -0,0 +1,79 @@
+import threading
+from user_contracts import entity_cache
+from user_contracts.models import Contract
+
+# Attribute of the request holding its loaders, so every operation of a
+# batched request shares them.
+LOADERS_ATTRIBUTE = "graphql_loaders"
+
+
+class Loader:
+    """
+    Per-request cache of objects by primary key.
+
+    Keys missing from the cache are loaded together with a single call to
+    `batch_load`, which receives a list of keys and returns a dictionary of
+    the objects found. Keys that were not found are cached as None.
+    """
+
+    def __init__(self, batch_load):
+        self.batch_load = batch_load
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        return self.load_many([key])[0]
+
+    def load_many(self, keys):
+        keys = [int(key) for key in keys]
+        with self._lock:
+            missing = list({key for key in keys if key not in self._cache})
+        if missing:
+            loaded = self.batch_load(missing)
+            with self._lock:
+                for key in missing:
+                    self._cache.setdefault(key, loaded.get(key))
+        with self._lock:
+            return [self._cache[key] for key in keys]
+
+    def prime(self, key, value):
+        with self._lock:
+            self._cache.setdefault(int(key), value)
+
+    def clear(self, key):
+        with self._lock:
+            self._cache.pop(int(key), None)
+
+
+class Loaders:
+    """
+    The loaders of a request, reading through the entity caches.
+
+    Contracts are cached without their user: the users of the contracts
+    loaded from the cache are loaded with the users loader, those of the
+    contracts read from the database come with them and prime it.
+    """
+
+    def __init__(self):
+        self.users = Loader(entity_cache.users.get_many)
+        self.contracts = Loader(self.load_contracts)
+
+    def load_contracts(self, ids):
+        contracts = entity_cache.contracts.get_many(ids)
+        for contract in contracts.values():
+            if Contract.user.is_cached(contract):
+                self.users.prime(contract.user_id, contract.user)
+        uncached = [c for c in contracts.values() if not Contract.user.is_cached(c)]
+        users = self.users.load_many([contract.user_id for contract in uncached])
+        for contract, user in zip(uncached, users):
+            contract.user = user
+        return contracts
+
+
+def get_loaders(context):
+    """Return the loaders of a request, creating them on first use."""
+    loaders = getattr(context, LOADERS_ATTRIBUTE, None)
+    if loaders is None:
+        loaders = Loaders()
+        setattr(context, LOADERS_ATTRIBUTE, loaders)
+    return loaders
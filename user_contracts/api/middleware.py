@@ -0,0 +1,28 @@
+import time
+from user_contracts.instrumentation import current_stats
+
+
+class MetricsMiddleware:
+    """
+    Graphene middleware naming the running operation and timing every
+    resolved field.
+
+    Outside of a `ContractsGraphQLView` request it does nothing.
+    """
+
+    def resolve(self, next, root, info, **kwargs):
+        stats = current_stats.get()
+        if stats is None:
+            return next(root, info, **kwargs)
+
+        if info.path.prev is None:
+            stats.set_operation(info.operation, info.field_name)
+
+        start = time.perf_counter()
+        try:
+            return next(root, info, **kwargs)
+        finally:
+            stats.record_field(
+                f"{info.parent_type.name}.{info.field_name}",
+                time.perf_counter() - start,
+            )
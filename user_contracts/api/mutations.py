@@ -4,9 +4,13 @@ from graphql import GraphQLError
 from graphql_jwt.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from user_contracts.models import Contract
+from django.db import transaction
+from user_contracts import changes
+from user_contracts.models import ArchivedContract, Contract
+from user_contracts.offboarding import is_being_offboarded, start_offboarding
+from .loaders import get_loaders
 from .inputs import UserInput, ContractInput
-from .types import UserType, ContractType
+from .types import UserType, ContractType, UserOffboardingType
 
 
 class CreateUserMutation(graphene.Mutation):
@@ -27,9 +31,11 @@ class CreateUserMutation(graphene.Mutation):
 
     def mutate(self, info, input):
         try:
-            user = User.objects.create_user(
-                username=input.username, email=input.email, password=input.password
-            )
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    username=input.username, email=input.email, password=input.password
+                )
+                changes.user_changed(user)
             return CreateUserMutation(
                 success=True, message="User created successfully.", user=user
             )
@@ -59,14 +65,19 @@ class UpdateUserMutation(graphene.Mutation):
     @login_required
     def mutate(self, info, id, input):
         try:
-            user = User.objects.get(pk=id)
-            if input.username:
-                user.username = input.username
-            if input.email:
-                user.email = input.email
-            if input.password:
-                user.set_password(input.password)
-            user.save()
+            with transaction.atomic():
+                user = User.objects.select_for_update().get(pk=id)
+                if input.username:
+                    user.username = input.username
+                if input.email:
+                    user.email = input.email
+                if input.password:
+                    user.set_password(input.password)
+                # An update of a user deleted meanwhile fails rather than
+                # inserting it again.
+                user.save(update_fields=["username", "email", "password"])
+                changes.user_changed(user)
+            get_loaders(info.context).users.clear(user.pk)
             return UpdateUserMutation(
                 success=True, message="User updated successfully.", user=user
             )
@@ -98,13 +109,20 @@ class DeleteUserMutation(graphene.Mutation):
             user = User.objects.get(pk=id)
 
             # Check if the user is attached to any contracts
-            if Contract.objects.filter(user=user).exists():
+            if (
+                Contract.objects.filter(user=user).exists()
+                or ArchivedContract.objects.filter(user=user).exists()
+            ):
                 raise GraphQLError(
                     "Cannot delete user because they are attached to a contract."
                 )
 
             # Proceed with deletion if no contracts are found
-            user.delete()
+            with transaction.atomic():
+                # Recorded first, the delete clears the primary key.
+                changes.user_changed(user)
+                user.delete()
+            get_loaders(info.context).users.clear(id)
             return DeleteUserMutation(
                 success=True, message="User deleted successfully."
             )
@@ -114,6 +132,40 @@ class DeleteUserMutation(graphene.Mutation):
             raise GraphQLError(f"Could not delete user: {str(e)}")
 
 
+class OffboardUserMutation(graphene.Mutation):
+    """
+    Mutation for offboarding a user in the GraphQL API.
+
+    Unlike `DeleteUserMutation` it accepts users with contracts: the user is
+    deactivated at once, then the `offboard_user --worker` command deletes
+    their contracts by chunks and the user last. It returns the offboarding,
+    whose progress can be followed with the `getOffboarding` query.
+    """
+
+    class Arguments:
+        id = graphene.ID(required=True)
+
+    offboarding = graphene.Field(UserOffboardingType)
+    success = graphene.Boolean()
+    message = graphene.String()
+
+    @login_required
+    def mutate(self, info, id):
+        try:
+            user = User.objects.get(pk=id)
+            offboarding = start_offboarding(user)
+            get_loaders(info.context).users.clear(user.pk)
+            return OffboardUserMutation(
+                success=True,
+                message="User offboarding started.",
+                offboarding=offboarding,
+            )
+        except User.DoesNotExist:
+            raise GraphQLError(f"User with ID {id} does not exist.")
+        except Exception as e:
+            raise GraphQLError(f"Could not offboard user: {str(e)}")
+
+
 class CreateContractMutation(graphene.Mutation):
     """
     Mutation for creating a new contract in the GraphQL API.
@@ -134,14 +186,23 @@ class CreateContractMutation(graphene.Mutation):
     # @login_required
     def mutate(self, info, input):
         try:
-            user = User.objects.get(pk=input.user_id)
+            user = get_loaders(info.context).users.load(input.user_id)
+            if user is None:
+                raise User.DoesNotExist
+            if is_being_offboarded(user):
+                raise GraphQLError(
+                    "You cannot create a contract for a user being offboarded."
+                )
             contract = Contract(
                 description=input.description,
                 user=user,
                 fidelity=input.fidelity,
                 amount=input.amount,
             )
-            contract.save()
+            with transaction.atomic():
+                contract.save()
+                changes.contract_created(contract)
+            get_loaders(info.context).users.clear(user.pk)
             return CreateContractMutation(
                 success=True,
                 message="Contract created successfully.",
@@ -175,14 +236,22 @@ class UpdateContractMutation(graphene.Mutation):
     # @login_required
     def mutate(self, info, id, input):
         try:
-            contract = Contract.objects.get(pk=id)
-            if input.description:
-                contract.description = input.description
-            if input.fidelity:
-                contract.fidelity = input.fidelity
-            if input.amount:
-                contract.amount = input.amount
-            contract.save()
+            with transaction.atomic():
+                contract = Contract.objects.select_for_update().get(pk=id)
+                old_amount, old_fidelity = contract.amount, contract.fidelity
+                if input.description:
+                    contract.description = input.description
+                if input.fidelity:
+                    contract.fidelity = input.fidelity
+                if input.amount:
+                    contract.amount = input.amount
+                # The row is locked, so it cannot be archived before the
+                # update; the update fails rather than inserting it again.
+                contract.save(update_fields=["description", "fidelity", "amount"])
+                changes.contract_updated(contract, old_amount, old_fidelity)
+            loaders = get_loaders(info.context)
+            loaders.contracts.clear(contract.pk)
+            loaders.users.clear(contract.user_id)
             return UpdateContractMutation(
                 success=True,
                 message="Contract updated successfully.",
@@ -212,8 +281,15 @@ class DeleteContractMutation(graphene.Mutation):
     # @login_required
     def mutate(self, info, id):
         try:
-            contract = Contract.objects.get(pk=id)
-            contract.delete()
+            with transaction.atomic():
+                contract = Contract.objects.select_for_update().get(pk=id)
+                # Deleted through a queryset, which keeps the primary key of
+                # the instance for the change hooks.
+                Contract.objects.filter(pk=contract.pk).delete()
+                changes.contract_deleted(contract)
+            loaders = get_loaders(info.context)
+            loaders.contracts.clear(id)
+            loaders.users.clear(contract.user_id)
             return DeleteUserMutation(
                 success=True, message="Contract deleted successfully."
             )
@@ -236,6 +312,7 @@ class Mutation(graphene.ObjectType):
     create_user = CreateUserMutation.Field()
     update_user = UpdateUserMutation.Field()
     delete_user = DeleteUserMutation.Field()
+    offboard_user = OffboardUserMutation.Field()
 
     # contract mutations
     create_contract = CreateContractMutation.Field()
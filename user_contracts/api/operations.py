@@ -0,0 +1,114 @@
+from collections import namedtuple
+
+# A representative GraphQL operation of the API (see queries.md). These are
+# replayed by the `benchmark_graphql` command and the query-count regression
+# tests.
+# `variables` is called with a sample `(user_id, contract_id)` and returns the
+# variables to send with the document.
+Operation = namedtuple("Operation", ["name", "document", "variables"])
+
+OPERATIONS = {
+    operation.name: operation
+    for operation in [
+        Operation(
+            "AllUsers",
+            """
+            query AllUsers {
+                allUsers {
+                    id
+                    username
+                    email
+                }
+            }
+            """,
+            lambda user_id, contract_id: {},
+        ),
+        Operation(
+            "AllContracts",
+            """
+            query AllContracts {
+                allContracts {
+                    id
+                    description
+                    user {
+                        id
+                    }
+                    createdAt
+                    fidelity
+                    amount
+                }
+            }
+            """,
+            lambda user_id, contract_id: {},
+        ),
+        Operation(
+            "GetUser",
+            """
+            query GetUser($id: Int!) {
+                getUser(id: $id) {
+                    id
+                    username
+                    email
+                    contractCount
+                    totalAmount
+                    averageFidelity
+                }
+            }
+            """,
+            lambda user_id, contract_id: {"id": user_id},
+        ),
+        Operation(
+            "GetContract",
+            """
+            query GetContract($id: Int!) {
+                getContract(id: $id) {
+                    id
+                    description
+                    user {
+                        id
+                    }
+                    createdAt
+                    fidelity
+                    amount
+                }
+            }
+            """,
+            lambda user_id, contract_id: {"id": contract_id},
+        ),
+        Operation(
+            "GetContractsByUserId",
+            """
+            query GetContractsByUserId($id: Int!) {
+                getContractsByUserId(id: $id) {
+                    id
+                    amount
+                    description
+                    fidelity
+                    user {
+                        id
+                    }
+                }
+            }
+            """,
+            lambda user_id, contract_id: {"id": user_id},
+        ),
+        Operation(
+            "SearchContracts",
+            """
+            query SearchContracts($text: String!) {
+                searchContracts(text: $text, first: 20) {
+                    edges {
+                        rank
+                        node {
+                            id
+                            description
+                        }
+                    }
+                    hasNextPage
+                }
+            }
+            """,
+            lambda user_id, contract_id: {"text": "solar maintenance"},
+        ),
+    ]
+}
@@ -1,10 +1,25 @@
 import graphene
 from graphql import GraphQLError
+from graphql_relay import cursor_to_offset, offset_to_cursor
 from django.contrib.auth.models import User
-from user_contracts.models import Contract
-from .types import UserType, ContractType
+from user_contracts.analytics import revenue_projection
+from user_contracts.archive import read_contracts
+from user_contracts.models import Contract, UserOffboarding
+from user_contracts.search import search_contracts
+from .loaders import get_loaders
+from .types import (
+    UserType,
+    ContractType,
+    ContractSearchEdge,
+    ContractSearchResult,
+    RevenueGroupBy,
+    RevenueProjectionBucket,
+    UserOffboardingType,
+)
 from graphql_jwt.decorators import login_required
 
+MAX_SEARCH_PAGE_SIZE = 100
+
 
 class Query(graphene.ObjectType):
     """
@@ -14,20 +29,46 @@ class Query(graphene.ObjectType):
 
     # User queries
     all_users = graphene.List(UserType)
-    all_contracts = graphene.List(ContractType)
+    all_contracts = graphene.List(
+        ContractType,
+        created_after=graphene.DateTime(),
+        created_before=graphene.DateTime(),
+    )
     get_user = graphene.Field(UserType, id=graphene.Int(required=True))
+    get_offboarding = graphene.Field(
+        UserOffboardingType, user_id=graphene.Int(required=True)
+    )
 
     # Contract queries
     get_contract = graphene.Field(ContractType, id=graphene.Int(required=True))
     get_contracts_by_user_id = graphene.List(
-        ContractType, id=graphene.Int(required=True)
+        ContractType,
+        id=graphene.Int(required=True),
+        created_after=graphene.DateTime(),
+        created_before=graphene.DateTime(),
+    )
+    search_contracts = graphene.Field(
+        ContractSearchResult,
+        text=graphene.String(required=True),
+        first=graphene.Int(default_value=20),
+        after=graphene.String(),
+    )
+
+    # Analytics queries
+    revenue_projection = graphene.List(
+        RevenueProjectionBucket,
+        from_=graphene.Date(required=True, name="from"),
+        to=graphene.Date(required=True),
+        group_by=RevenueGroupBy(default_value=RevenueGroupBy.MONTH.value),
     )
 
     # @login_required
-    def resolve_get_contracts_by_user_id(self, info, id):
+    def resolve_get_contracts_by_user_id(
+        self, info, id, created_after=None, created_before=None
+    ):
         """This method will return a lisf of contracts attached to a user"""
         try:
-            return Contract.objects.filter(user=id)
+            return read_contracts(created_after, created_before, user=id)
         except Contract.DoesNotExist:
             return GraphQLError("Contract does not exist.")
         except Exception as e:
@@ -36,25 +77,72 @@ class Query(graphene.ObjectType):
     # @login_required
     def resolve_get_user(self, info, id):
         """This method will return a user from an user id"""
-        try:
-            return User.objects.get(pk=id)
-        except User.DoesNotExist:
+        user = get_loaders(info.context).users.load(id)
+        if user is None:
             raise GraphQLError("User does not exist.")
+        return user
+
+    @login_required
+    def resolve_get_offboarding(self, info, user_id):
+        """This method will return the offboarding progress of a user"""
+        offboarding = UserOffboarding.objects.filter(user_id=user_id).first()
+        if offboarding is None:
+            raise GraphQLError("User is not being offboarded.")
+        return offboarding
 
     # @login_required
     def resolve_get_contract(self, info, id):
         """This method will return a contract from an contract id"""
-        try:
-            return Contract.objects.get(pk=id)
-        except Contract.DoesNotExist:
+        contract = get_loaders(info.context).contracts.load(id)
+        if contract is None:
             raise GraphQLError("Contract does not exist.")
+        return contract
 
     # @login_required
     def resolve_all_users(self, info):
         """This method will return a list of users"""
-        return User.objects.all()
+        return User.objects.select_related("contract_summary")
 
     # @login_required
-    def resolve_all_contracts(self, info):
+    def resolve_all_contracts(self, info, created_after=None, created_before=None):
         """This method will return a list of contracts"""
-        return Contract.objects.all()
+        return read_contracts(created_after, created_before)
+
+    # @login_required
+    def resolve_search_contracts(self, info, text, first=20, after=None):
+        """This method will return contracts whose description matches a text"""
+        if first < 1 or first > MAX_SEARCH_PAGE_SIZE:
+            raise GraphQLError(f"first must be between 1 and {MAX_SEARCH_PAGE_SIZE}.")
+        offset = 0
+        if after:
+            after_offset = cursor_to_offset(after)
+            if after_offset is None:
+                raise GraphQLError("Invalid cursor.")
+            offset = after_offset + 1
+
+        page, has_next_page = search_contracts(text, first, offset)
+        edges = [
+            ContractSearchEdge(
+                cursor=offset_to_cursor(offset + index), rank=rank, node=contract
+            )
+            for index, (contract, rank) in enumerate(page)
+        ]
+        return ContractSearchResult(
+            edges=edges,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_next_page=has_next_page,
+        )
+
+    # @login_required
+    def resolve_revenue_projection(self, info, from_, to, group_by="month"):
+        """This method will return the projected revenue of a period"""
+        try:
+            projection = revenue_projection(
+                from_, to, getattr(group_by, "value", group_by)
+            )
+        except ValueError as e:
+            raise GraphQLError(str(e))
+        return [
+            RevenueProjectionBucket(key=key, month=month, amount=amount)
+            for key, month, amount in projection
+        ]
@@ -1,7 +1,9 @@
 import graphene
 from graphene_django import DjangoObjectType
 from django.contrib.auth.models import User
-from user_contracts.models import Contract
+from user_contracts.models import Contract, UserOffboarding
+from user_contracts.summaries import get_summary
+from .loaders import get_loaders
 
 
 class UserType(DjangoObjectType):
@@ -9,22 +11,98 @@ class UserType(DjangoObjectType):
     GraphQL type for the User model.
 
     This class maps the User Django model to a GraphQL type, making it accessible
-    in GraphQL queries and mutations.
+    in GraphQL queries and mutations. The contract totals are read from the
+    denormalized `UserContractSummary` row of the user.
     """
 
+    contract_count = graphene.Int()
+    total_amount = graphene.Decimal()
+    average_fidelity = graphene.Float()
+
     class Meta:
         model = User
         field = "__all__"
 
+    def resolve_contract_count(self, info):
+        summary = get_summary(self)
+        return summary.contract_count if summary else 0
+
+    def resolve_total_amount(self, info):
+        summary = get_summary(self)
+        return summary.total_amount if summary else 0
+
+    def resolve_average_fidelity(self, info):
+        summary = get_summary(self)
+        return summary.average_fidelity if summary else None
+
 
 class ContractType(DjangoObjectType):
     """
     GraphQL type for the Contract model.
 
     This class maps the User Django model to a GraphQL type, making it accessible
-    in GraphQL queries and mutations.
+    in GraphQL queries and mutations. Contracts read from the archive are
+    returned as `Contract` instances too, with `archived` set.
     """
 
+    archived = graphene.Boolean()
+
     class Meta:
         model = Contract
         fields = "__all__"
+
+    def resolve_user(self, info):
+        if Contract.user.is_cached(self):
+            return self.user
+        return get_loaders(info.context).users.load(self.user_id)
+
+
+class UserOffboardingType(DjangoObjectType):
+    """
+    GraphQL type for the UserOffboarding model: the progress of the deletion
+    of a user and of their contracts.
+    """
+
+    class Meta:
+        model = UserOffboarding
+        exclude = ("id",)
+
+
+class ContractSearchEdge(graphene.ObjectType):
+    """
+    A single result of a contract search, with its relevance rank and the
+    cursor to pass as `after` to continue after it.
+    """
+
+    cursor = graphene.String()
+    rank = graphene.Float()
+    node = graphene.Field(ContractType)
+
+
+class ContractSearchResult(graphene.ObjectType):
+    """
+    A page of contract search results ordered by relevance.
+    """
+
+    edges = graphene.List(ContractSearchEdge)
+    end_cursor = graphene.String()
+    has_next_page = graphene.Boolean()
+
+
+class RevenueGroupBy(graphene.Enum):
+    """How the projected revenue is grouped."""
+
+    MONTH = "month"
+    USER = "user"
+    TIER = "tier"
+
+
+class RevenueProjectionBucket(graphene.ObjectType):
+    """
+    Projected revenue of a group: a month of the window (with `month` set),
+    or a user id or a fidelity term for the whole window.
+    """
+
+    key = graphene.String()
+    month = graphene.Date()
+    amount = graphene.Decimal()
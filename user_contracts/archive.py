@@ -0,0 +1,131 @@
+from datetime import timedelta
+from itertools import chain
+from operator import attrgetter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from user_contracts import changes
+from user_contracts.entity_cache import cache_is_shared
+from user_contracts.models import ArchivedContract, Contract
+
+BOUNDARY_CACHE_KEY = "contract-archive-boundary"
+BOUNDARY_CACHE_TIMEOUT = 60
+
+
+def archive_after_days():
+    return getattr(settings, "CONTRACT_ARCHIVE_AFTER_DAYS", 2 * 365)
+
+
+def default_cutoff(days=None):
+    if days is None:
+        days = archive_after_days()
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_boundary():
+    """
+    Creation date of the newest archived contract, None when the archive is
+    empty. Queries for periods after it never need the archive.
+
+    It is cached when the Django cache is shared by the processes, which
+    then all see `forget_boundary` from the archiving one. Otherwise it is
+    read from the `created_at` index every time.
+    """
+    shared = cache_is_shared()
+    boundary = cache.get(BOUNDARY_CACHE_KEY) if shared else None
+    if boundary is None:
+        boundary = ArchivedContract.objects.aggregate(newest=Max("created_at"))[
+            "newest"
+        ]
+        if shared:
+            # An empty archive is cached too, as False.
+            cache.set(BOUNDARY_CACHE_KEY, boundary or False, BOUNDARY_CACHE_TIMEOUT)
+    return boundary or None
+
+
+def forget_boundary():
+    cache.delete(BOUNDARY_CACHE_KEY)
+
+
+def archive_batch(cutoff, size):
+    """
+    Move the next `size` contracts created before `cutoff` to the archive,
+    in a transaction of their own, and return how many were moved.
+    """
+    with transaction.atomic():
+        contracts = list(
+            Contract.objects.select_for_update()
+            .filter(created_at__lt=cutoff)
+            .order_by("pk")[:size]
+        )
+        if not contracts:
+            return 0
+        ArchivedContract.objects.bulk_create(
+            [
+                ArchivedContract(
+                    id=contract.pk,
+                    description=contract.description,
+                    user_id=contract.user_id,
+                    created_at=contract.created_at,
+                    fidelity=contract.fidelity,
+                    amount=contract.amount,
+                )
+                for contract in contracts
+            ]
+        )
+        ids = [contract.pk for contract in contracts]
+        Contract.objects.filter(pk__in=ids).delete()
+        changes.contracts_archived(ids)
+    forget_boundary()
+    return len(ids)
+
+
+def archive_contracts(cutoff=None, size=1000, progress=None):
+    """
+    Move every contract created before `cutoff` (by default
+    `CONTRACT_ARCHIVE_AFTER_DAYS` ago) to the archive by batches of `size`,
+    and return how many were moved. `progress` is called with the running
+    total after every batch.
+    """
+    cutoff = cutoff or default_cutoff()
+    moved = 0
+    while True:
+        count = archive_batch(cutoff, size)
+        if not count:
+            return moved
+        moved += count
+        if progress:
+            progress(moved)
+
+
+def needs_archive(created_after=None, created_before=None):
+    """
+    Tell whether the contracts of a period may be in the archive. Queries
+    without a period only read the contracts table.
+    """
+    if created_after is None and created_before is None:
+        return False
+    boundary = archive_boundary()
+    return boundary is not None and (created_after is None or created_after <= boundary)
+
+
+def read_contracts(created_after=None, created_before=None, **filters):
+    """
+    Contracts matching `filters` created in the period, a queryset of the
+    contracts table when the period does not reach the archive, else a
+    list, by id, also holding the matching archived contracts.
+    """
+    if created_after is not None:
+        filters["created_at__gte"] = created_after
+    if created_before is not None:
+        filters["created_at__lt"] = created_before
+    contracts = Contract.objects.filter(**filters).select_related("user")
+    if not needs_archive(created_after, created_before):
+        return contracts
+    archived = ArchivedContract.objects.filter(**filters).select_related("user")
+    return sorted(
+        chain(contracts, (contract.to_contract() for contract in archived)),
+        key=attrgetter("pk"),
+    )
@@ -0,0 +1,247 @@
+import json
+import math
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from contextlib import nullcontext
+from urllib.parse import urljoin
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from user_contracts.models import Contract
+
+GRAPHQL_PATH = "/graphql/"
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def load_samples(limit=1000):
+    """
+    Return `(user_id, contract_id)` pairs to fill the operation variables
+    with, taken from the most recent contracts like most real traffic.
+    """
+    return list(
+        Contract.objects.order_by("-pk").values_list("user_id", "pk")[:limit]
+    ) or [(0, 0)]
+
+
+class InProcessTransport:
+    """
+    Send operations through Django's test client, in this process, counting
+    the SQL queries each one issues.
+
+    All the requests come from the same address, so the admission control
+    is disabled while the benchmark runs unless `admission` is true.
+    """
+
+    def __init__(self, token=None, admission=False):
+        self.headers = {"HTTP_HOST": "localhost"}
+        if token:
+            self.headers["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        self.admission = admission
+
+    def running(self):
+        """Context manager wrapping the whole benchmark."""
+        if self.admission:
+            return nullcontext()
+        return override_settings(
+            GRAPHQL_RATE_LIMIT_RATE=0, GRAPHQL_MAX_CONCURRENT_REQUESTS=0
+        )
+
+    def send(self, document, variables):
+        counter = {"queries": 0}
+
+        def count_queries(execute, sql, params, many, context):
+            counter["queries"] += 1
+            return execute(sql, params, many, context)
+
+        client = Client(**self.headers)
+        with connection.execute_wrapper(count_queries):
+            response = client.post(
+                GRAPHQL_PATH,
+                json.dumps({"query": document, "variables": variables}),
+                content_type="application/json",
+            )
+        return response.status_code, response.content, counter["queries"]
+
+    def sql_counts(self):
+        return None
+
+    def close(self):
+        connection.close()
+
+
+class HttpTransport:
+    """
+    Send operations to a running server. The SQL counts are read from the
+    difference of its `/metrics` before and after the run.
+    """
+
+    def __init__(self, url, token=None, metrics_url=None):
+        self.url = url
+        self.metrics_url = metrics_url or urljoin(url, "/metrics")
+        self.headers = {"Content-Type": "application/json"}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+
+    def send(self, document, variables):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"query": document, "variables": variables}).encode(),
+            headers=self.headers,
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read(), None
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), None
+
+    def running(self):
+        return nullcontext()
+
+    def sql_counts(self):
+        """Return `{operation: [sql queries sum, operations count]}`."""
+        try:
+            with urllib.request.urlopen(self.metrics_url) as response:
+                lines = response.read().decode().splitlines()
+        except OSError:
+            return None
+        counts = {}
+        for line in lines:
+            for suffix, index in (("_sum", 0), ("_count", 1)):
+                prefix = f'graphql_operation_sql_queries{suffix}{{operation="'
+                if line.startswith(prefix):
+                    operation, value = line[len(prefix) :].split('"} ')
+                    counts.setdefault(operation, [0, 0])[index] = float(value)
+        return counts
+
+    def close(self):
+        pass
+
+
+def _is_error(status, body):
+    if status != 200:
+        return True
+    try:
+        return "errors" in json.loads(body)
+    except ValueError:
+        return True
+
+
+def run_operation(transport, operation, requests, concurrency, samples, warmup=0):
+    """
+    Send `requests` times `operation` with `concurrency` parallel clients and
+    return its statistics.
+    """
+    for index in range(warmup):
+        transport.send(
+            operation.document, operation.variables(*samples[index % len(samples)])
+        )
+
+    pending = queue.Queue()
+    for index in range(requests):
+        pending.put(index)
+    latencies, sql_queries, errors = [], [], []
+
+    def work(close=True):
+        try:
+            while True:
+                try:
+                    index = pending.get_nowait()
+                except queue.Empty:
+                    return
+                variables = operation.variables(*samples[index % len(samples)])
+                start = time.perf_counter()
+                status, body, queries = transport.send(operation.document, variables)
+                latency = time.perf_counter() - start
+                # Failed and rejected requests are counted, not timed.
+                if _is_error(status, body):
+                    errors.append(status)
+                    continue
+                latencies.append(latency)
+                if queries is not None:
+                    sql_queries.append(queries)
+        finally:
+            if close:
+                transport.close()
+
+    before = transport.sql_counts()
+    started = time.perf_counter()
+    if concurrency <= 1:
+        work(close=False)
+    else:
+        threads = [threading.Thread(target=work) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    after = transport.sql_counts()
+
+    latencies.sort()
+    result = {
+        "requests": requests,
+        "errors": len(errors),
+        "error_statuses": {
+            str(status): count for status, count in Counter(errors).items()
+        },
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": dict.fromkeys(("p50", "p95", "p99", "mean", "max")),
+        "sql_queries": None,
+    }
+    if latencies:
+        result["latency_ms"] = {
+            name: round(percentile(latencies, fraction) * 1000, 3)
+            for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+        }
+        result["latency_ms"]["mean"] = round(sum(latencies) / len(latencies) * 1000, 3)
+        result["latency_ms"]["max"] = round(latencies[-1] * 1000, 3)
+
+    if sql_queries:
+        result["sql_queries"] = {
+            "mean": round(sum(sql_queries) / len(sql_queries), 2),
+            "max": max(sql_queries),
+        }
+    elif before is not None and after is not None:
+        total, count = after.get(operation.name, [0, 0])
+        previous_total, previous_count = before.get(operation.name, [0, 0])
+        if count > previous_count:
+            result["sql_queries"] = {
+                "mean": round((total - previous_total) / (count - previous_count), 2)
+            }
+    return result
+
+
+def run_benchmark(transport, operations, requests=200, concurrency=4, warmup=10):
+    """
+    Benchmark each operation in turn and return the machine-readable report.
+    Throughput and latencies only cover the successful requests.
+    """
+    samples = load_samples()
+    with transport.running():
+        return {
+            "started_at": timezone.now().isoformat(),
+            "config": {
+                "requests": requests,
+                "concurrency": concurrency,
+                "warmup": warmup,
+                "contracts": Contract.objects.count(),
+            },
+            "operations": {
+                operation.name: run_operation(
+                    transport, operation, requests, concurrency, samples, warmup
+                )
+                for operation in operations
+            },
+        }
@@ -0,0 +1,63 @@
+from user_contracts import entity_cache, outbox, streams, summaries, versions
+
+# Every write to users and contracts goes through these functions, in the
+# transaction of the write, so the data derived from them stays in sync.
+
+
+def contract_created(contract):
+    summaries.contract_created(contract)
+    versions.bump(contract.user_id, versions.CONTRACTS)
+    streams.publish([outbox.record(outbox.CONTRACT_CREATED, contract)])
+    # The cached user holds the summary of their contracts.
+    entity_cache.contracts.invalidate(contract.pk)
+    entity_cache.users.invalidate(contract.user_id)
+
+
+def contract_updated(contract, old_amount, old_fidelity):
+    summaries.contract_updated(contract, old_amount, old_fidelity)
+    versions.bump(contract.user_id, versions.CONTRACTS)
+    streams.publish([outbox.record(outbox.CONTRACT_UPDATED, contract)])
+    entity_cache.contracts.invalidate(contract.pk)
+    entity_cache.users.invalidate(contract.user_id)
+
+
+def contract_deleted(contract):
+    summaries.contract_deleted(contract)
+    versions.bump(contract.user_id, versions.CONTRACTS)
+    streams.publish([outbox.record(outbox.CONTRACT_DELETED, contract)])
+    entity_cache.contracts.invalidate(contract.pk)
+    entity_cache.users.invalidate(contract.user_id)
+
+
+def contracts_deleted(user_id, contract_ids, amount, fidelity):
+    """
+    Record the deletion of some contracts of a user, `amount` and
+    `fidelity` being their totals.
+    """
+    summaries.apply_contract_delta(
+        user_id, count=-len(contract_ids), amount=-amount, fidelity=-fidelity
+    )
+    versions.bump(user_id, versions.CONTRACTS)
+    streams.publish(outbox.record_deleted(user_id, contract_ids))
+    entity_cache.contracts.invalidate(*contract_ids)
+    entity_cache.users.invalidate(user_id)
+
+
+def contracts_archived(contract_ids):
+    """
+    Record the move of contracts to the archive. They still exist, so the
+    summaries and the outbox are left alone.
+    """
+    versions.bump(None, versions.CONTRACTS)
+    entity_cache.contracts.invalidate(*contract_ids)
+
+
+def user_changed(user):
+    versions.bump(user.pk, versions.USERS)
+    entity_cache.users.invalidate(user.pk)
+
+
+def bulk_changed():
+    """Record a bulk write that bypassed the per-row functions."""
+    versions.bump(None, versions.USERS, versions.CONTRACTS)
+    entity_cache.clear()
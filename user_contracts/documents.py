@@ -0,0 +1,34 @@
+from collections import namedtuple
+from functools import lru_cache
+from graphene_django.settings import graphene_settings
+from graphql import parse, validate
+
+# Documents kept parsed and validated, enough for the operations of the
+# clients; arbitrary documents only evict each other.
+DOCUMENT_CACHE_SIZE = 1024
+
+CompiledDocument = namedtuple("CompiledDocument", ["document", "errors"])
+
+
+@lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def compile_document(schema, query, validation_rules=None):
+    """
+    Parse `query` and validate it against `schema` (a graphql-core schema),
+    once per distinct document.
+
+    Returns the document and the list of errors found; the document is None
+    when it could not be parsed. Validation only depends on the document
+    and the schema, so the result is shared by every request sending the
+    same document.
+    """
+    try:
+        document = parse(query)
+    except Exception as e:
+        return CompiledDocument(None, [e])
+    errors = validate(
+        schema,
+        document,
+        list(validation_rules) if validation_rules is not None else None,
+        graphene_settings.MAX_VALIDATION_ERRORS,
+    )
+    return CompiledDocument(document, errors)
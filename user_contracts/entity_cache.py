@@ -0,0 +1,239 @@
+import copy
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from user_contracts.metrics import registry
+from user_contracts.models import ArchivedContract, Contract
+
+ENTITY_CACHE_REQUESTS = registry.counter(
+    "entity_cache_requests",
+    "Entity cache lookups, by cache and by the tier that answered them.",
+    ["cache", "result"],
+)
+LOCAL_HIT = "local_hit"
+SHARED_HIT = "shared_hit"
+MISS = "miss"
+
+
+def local_size():
+    return getattr(settings, "ENTITY_CACHE_LOCAL_SIZE", 10_000)
+
+
+def local_ttl():
+    return getattr(settings, "ENTITY_CACHE_LOCAL_TTL", 5)
+
+
+def shared_ttl():
+    return getattr(settings, "ENTITY_CACHE_TTL", 300)
+
+
+def cache_is_shared():
+    """
+    Tell whether the Django cache is shared by the processes. The default
+    one lives in the memory of each process: the invalidations made by
+    other processes, such as the workers and the management commands,
+    never reach it.
+    """
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+class EntityCache:
+    """
+    Read-through cache of model instances by primary key.
+
+    Lookups go to an in-process LRU first, then to the Django cache shared
+    by the processes, and the remaining keys are loaded together by
+    `load_many`, which receives a list of keys and returns a dictionary of
+    the objects found. Objects that do not exist are not cached.
+
+    Entries are stored pickled and every lookup returns fresh copies, so
+    callers may modify them. The relations named in `exclude_relations` are
+    not stored with the object: they are cached on their own and would go
+    stale with it.
+
+    `invalidate` drops keys from the shared cache and from the LRU of the
+    current process; the LRUs of other processes keep serving them for at
+    most `ENTITY_CACHE_LOCAL_TTL` seconds. When the Django cache is not
+    shared by the processes (see `cache_is_shared`) only the LRU is used,
+    so that bound still holds.
+    """
+
+    def __init__(self, name, load_many, exclude_relations=()):
+        self.name = name
+        self.load_many = load_many
+        self.exclude_relations = tuple(exclude_relations)
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+
+    @property
+    def generation_key(self):
+        return f"entity:{self.name}:generation"
+
+    def generation(self):
+        """
+        Token of the shared entries that are current, changed by `clear` so
+        that every shared entry is abandoned at once. It is kept locally for
+        the local TTL.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._generation is not None and self._generation[1] > now:
+                return self._generation[0]
+        token = cache.get(self.generation_key)
+        if token is None:
+            cache.add(self.generation_key, uuid.uuid4().hex, None)
+            token = cache.get(self.generation_key)
+        with self._lock:
+            self._generation = (token, now + local_ttl())
+        return token
+
+    def shared_key(self, generation, key):
+        return f"entity:{self.name}:{generation}:{key}"
+
+    def dehydrate(self, obj):
+        if self.exclude_relations:
+            obj = copy.copy(obj)
+            for name in self.exclude_relations:
+                obj._state.fields_cache.pop(name, None)
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def get(self, key):
+        return self.get_many([key]).get(int(key))
+
+    def get_many(self, keys):
+        """Return a dictionary of the objects found for `keys`."""
+        keys = {int(key) for key in keys}
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._local.get(key)
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._local[key]
+                    continue
+                self._local.move_to_end(key)
+                found[key] = entry[0]
+        ENTITY_CACHE_REQUESTS.inc((self.name, LOCAL_HIT), len(found))
+
+        missing = keys - found.keys()
+        if missing and cache_is_shared():
+            generation = self.generation()
+            shared = cache.get_many([self.shared_key(generation, k) for k in missing])
+            from_shared = {}
+            for key in missing:
+                data = shared.get(self.shared_key(generation, key))
+                if data is not None:
+                    from_shared[key] = data
+            ENTITY_CACHE_REQUESTS.inc((self.name, SHARED_HIT), len(from_shared))
+            self._store_local(from_shared)
+            found.update(from_shared)
+            missing -= from_shared.keys()
+
+        objects = {key: pickle.loads(data) for key, data in found.items()}
+        if missing:
+            ENTITY_CACHE_REQUESTS.inc((self.name, MISS), len(missing))
+            loaded = self.load_many(list(missing))
+            self.put_many(loaded)
+            objects.update(loaded)
+        return objects
+
+    def put_many(self, objects):
+        """Cache `objects`, a dictionary of objects by primary key."""
+        if not objects:
+            return
+        stored = {int(key): self.dehydrate(obj) for key, obj in objects.items()}
+        if cache_is_shared():
+            generation = self.generation()
+            cache.set_many(
+                {self.shared_key(generation, k): v for k, v in stored.items()},
+                shared_ttl(),
+            )
+        self._store_local(stored)
+
+    def _store_local(self, entries):
+        if not entries:
+            return
+        expires = time.monotonic() + local_ttl()
+        size = local_size()
+        with self._lock:
+            for key, data in entries.items():
+                self._local[key] = (data, expires)
+                self._local.move_to_end(key)
+            while len(self._local) > size:
+                self._local.popitem(last=False)
+
+    def _drop(self, keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        if cache_is_shared():
+            generation = self.generation()
+            cache.delete_many([self.shared_key(generation, key) for key in keys])
+
+    def invalidate(self, *keys):
+        """
+        Drop `keys` now and again when the current transaction commits, so
+        that a read made in between does not keep the old rows cached.
+        """
+        keys = [int(key) for key in keys if key is not None]
+        if not keys:
+            return
+        self._drop(keys)
+        transaction.on_commit(lambda: self._drop(keys))
+
+    def clear(self):
+        """
+        Drop every entry. Other processes stop using theirs once they
+        notice the new generation, within the local TTL.
+        """
+        with self._lock:
+            self._local.clear()
+            self._generation = None
+        if cache_is_shared():
+            cache.set(self.generation_key, uuid.uuid4().hex, None)
+
+    def stats(self):
+        """Return the number of lookups answered by each tier."""
+        values = ENTITY_CACHE_REQUESTS.values()
+        return {
+            result: values.get((self.name, result), 0)
+            for result in (LOCAL_HIT, SHARED_HIT, MISS)
+        }
+
+
+def load_users(ids):
+    return User.objects.select_related("contract_summary").in_bulk(ids)
+
+
+def load_contracts(ids):
+    # The users come along so that a cold lookup of a contract and its user
+    # is a single query. They are cached on their own rather than with the
+    # contracts, which would keep them after they change.
+    contracts = Contract.objects.select_related("user__contract_summary").in_bulk(ids)
+    missing = [key for key in ids if key not in contracts]
+    if missing:
+        archived = ArchivedContract.objects.select_related("user__contract_summary")
+        for key, contract in archived.in_bulk(missing).items():
+            contracts[key] = contract.to_contract()
+    users.put_many({c.user_id: c.user for c in contracts.values()})
+    return contracts
+
+
+users = EntityCache("user", load_users)
+contracts = EntityCache("contract", load_contracts, exclude_relations=("user",))
+
+
+def clear():
+    users.clear()
+    contracts.clear()
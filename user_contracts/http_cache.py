@@ -0,0 +1,142 @@
+import hashlib
+import json
+from functools import lru_cache
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from graphql import (
+    FieldNode,
+    IntValueNode,
+    OperationType,
+    StringValueNode,
+    VariableNode,
+    get_operation_ast,
+    parse,
+)
+from user_contracts.versions import current_versions
+
+
+def get_max_age():
+    return getattr(settings, "GRAPHQL_GET_MAX_AGE", 5)
+
+
+@lru_cache(maxsize=1024)
+def is_read_only(query, operation_name=None):
+    """Tell whether the operation to run from `query` is a query."""
+    try:
+        operation = get_operation_ast(parse(query), operation_name)
+    except Exception:
+        return False
+    return operation is not None and operation.operation == OperationType.QUERY
+
+
+# Root query fields whose result only holds the data of the user given by
+# the argument named here, and so only changes with the versions of that
+# user.
+USER_SCOPED_FIELDS = {"getUser": "id", "getContractsByUserId": "id"}
+
+
+@lru_cache(maxsize=1024)
+def scoped_arguments(query, operation_name=None):
+    """
+    Return the user id arguments of the root fields of the operation, as
+    ints or as variable names, or None when a field is not user scoped.
+    """
+    try:
+        operation = get_operation_ast(parse(query), operation_name)
+    except Exception:
+        return None
+    if operation is None:
+        return None
+    arguments = []
+    for selection in operation.selection_set.selections:
+        if not isinstance(selection, FieldNode):
+            return None
+        field = selection.name.value
+        if field == "__typename":
+            continue
+        argument = next(
+            (
+                argument.value
+                for argument in selection.arguments
+                if argument.name.value == USER_SCOPED_FIELDS.get(field)
+            ),
+            None,
+        )
+        if isinstance(argument, VariableNode):
+            arguments.append(argument.name.value)
+        elif isinstance(argument, (IntValueNode, StringValueNode)):
+            try:
+                arguments.append(int(argument.value))
+            except ValueError:
+                return None
+        else:
+            return None
+    return tuple(arguments)
+
+
+def user_scope(query, variables, operation_name):
+    """
+    Return the id of the only user whose data the operation reads, or None
+    when it reads the data of several users or cannot tell.
+    """
+    arguments = scoped_arguments(query, operation_name)
+    if not arguments:
+        return None
+    user_ids = set()
+    for argument in arguments:
+        if isinstance(argument, str):
+            argument = (variables or {}).get(argument)
+        try:
+            user_ids.add(int(argument))
+        except (TypeError, ValueError):
+            return None
+    return user_ids.pop() if len(user_ids) == 1 else None
+
+
+def compute_etag(request, query, variables, operation_name):
+    """
+    Weak ETag of the response to a GET query.
+
+    It is derived from the operation, the credentials it runs with and the
+    current data version stamps instead of from the response body, so it
+    is known before executing the query. It must be computed before the
+    query runs: a change committed in between then yields a newer body
+    under the older tag, which only costs one extra full response later.
+
+    The operations reading the data of a single user only depend on the
+    versions of that user, so writes for other users keep their tag.
+    """
+    key = json.dumps(
+        [
+            query,
+            variables,
+            operation_name,
+            request.headers.get("Authorization", ""),
+            sorted(
+                current_versions(user_scope(query, variables, operation_name)).items()
+            ),
+        ],
+        sort_keys=True,
+    )
+    return 'W/"%s"' % hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("If-None-Match", "")
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def patch_cache_headers(request, response, etag):
+    """
+    Let clients cache the response, and shared caches such as a reverse
+    proxy too unless it was computed with the credentials of the request:
+    a cache ignoring `Vary` would serve it to other clients.
+    """
+    response["ETag"] = etag
+    if request.headers.get("Authorization"):
+        patch_cache_control(response, private=True, max_age=get_max_age())
+    else:
+        patch_cache_control(response, public=True, max_age=get_max_age())
+    patch_vary_headers(response, ("Authorization",))
+    return response
@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from user_contracts.metrics import COUNT_BUCKETS, registry
+
+OPERATION_DURATION = registry.histogram(
+    "graphql_operation_duration_seconds",
+    "Time spent executing a GraphQL operation.",
+    ["operation"],
+)
+OPERATION_ERRORS = registry.counter(
+    "graphql_operation_errors",
+    "GraphQL operations that returned errors.",
+    ["operation"],
+)
+OPERATION_SQL_QUERIES = registry.histogram(
+    "graphql_operation_sql_queries",
+    "SQL queries issued by a GraphQL operation.",
+    ["operation"],
+    buckets=COUNT_BUCKETS,
+)
+OPERATION_DB_SECONDS = registry.counter(
+    "graphql_operation_db_seconds",
+    "Time spent in the database by GraphQL operations.",
+    ["operation"],
+)
+FIELD_DURATION = registry.histogram(
+    "graphql_field_duration_seconds",
+    "Time spent resolving a field, for sampled operations only.",
+    ["operation", "field"],
+)
+
+# Statements kept per operation for the slow-operation log, the remaining
+# ones are only counted.
+MAX_SQL_STATEMENTS = 200
+
+# Operation names come from clients, so only a bounded number of distinct
+# names get their own label value; the others are grouped together.
+MAX_OPERATION_NAMES = 200
+OTHER_OPERATIONS = "other"
+
+_operation_names = set()
+_operation_names_lock = threading.Lock()
+
+current_stats = ContextVar("graphql_request_stats", default=None)
+
+
+def operation_label(name):
+    if name in _operation_names:
+        return name
+    with _operation_names_lock:
+        if len(_operation_names) >= MAX_OPERATION_NAMES:
+            return OTHER_OPERATIONS
+        _operation_names.add(name)
+    return name
+
+
+def field_timing_sample_rate():
+    return getattr(settings, "GRAPHQL_FIELD_TIMING_SAMPLE_RATE", 0.01)
+
+
+def slow_log_sample_rate():
+    return getattr(settings, "GRAPHQL_SLOW_LOG_SAMPLE_RATE", 0.001)
+
+
+class OperationStats:
+    """
+    Measurements of a single GraphQL operation, collected by the view, the
+    graphene `MetricsMiddleware` and the database execute wrapper.
+    """
+
+    def __init__(self, operation_name=None, export_fields=None, log_sampled=None):
+        self.operation_name = operation_name
+        if log_sampled is None:
+            log_sampled = random.random() < slow_log_sample_rate()
+        self.log_sampled = log_sampled
+        if export_fields is None:
+            export_fields = random.random() < field_timing_sample_rate()
+        self.export_fields = export_fields
+        self.started_at = time.perf_counter()
+        self.duration = None
+        self.sql_queries = 0
+        self.db_time = 0.0
+        self.field_timings = {}
+        self.sql_statements = []
+
+    @property
+    def label(self):
+        return operation_label(self.operation_name or "anonymous")
+
+    def set_operation(self, operation, field_name):
+        """Name the operation after the document, or its first root field."""
+        if self.operation_name:
+            return
+        if operation.name:
+            self.operation_name = operation.name.value
+        else:
+            self.operation_name = f"{operation.operation.value}:{field_name}"
+
+    def record_field(self, field, duration):
+        """
+        Add up the time of a resolved field. The totals of every operation
+        are kept for the slow-operation log, which only knows whether it
+        needs them once the operation is over; the histogram is only fed by
+        a sample of the operations.
+        """
+        count, total = self.field_timings.get(field, (0, 0.0))
+        self.field_timings[field] = (count + 1, total + duration)
+        if self.export_fields:
+            FIELD_DURATION.observe((self.label, field), duration)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper counting the SQL issued and its time, and
+        keeping the statements for the slow-operation log.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.sql_queries += 1
+            self.db_time += duration
+            if len(self.sql_statements) < MAX_SQL_STATEMENTS:
+                rowcount = getattr(context.get("cursor"), "rowcount", -1)
+                self.sql_statements.append(
+                    (sql, duration, rowcount if rowcount >= 0 else None)
+                )
+
+    def finish(self, result=None):
+        self.duration = time.perf_counter() - self.started_at
+        label = self.label
+        OPERATION_DURATION.observe((label,), self.duration)
+        OPERATION_SQL_QUERIES.observe((label,), self.sql_queries)
+        OPERATION_DB_SECONDS.inc((label,), self.db_time)
+        if result is None or result.errors:
+            OPERATION_ERRORS.inc((label,))
@@ -0,0 +1,51 @@
+import time
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+from django.core.management.base import BaseCommand, CommandError
+from user_contracts.archive import archive_after_days, archive_contracts, default_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the contracts created before a cutoff to the archive table, "
+        "by batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--before",
+            help="Archive the contracts created before this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            help="Archive the contracts older than this many days "
+            f"(default: CONTRACT_ARCHIVE_AFTER_DAYS, {archive_after_days()}).",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options["before"] and options["older_than_days"] is not None:
+            raise CommandError("Pass either --before or --older-than-days.")
+        if options["before"]:
+            try:
+                day = datetime.strptime(options["before"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--before must be a date, YYYY-MM-DD.")
+            cutoff = datetime.combine(day, dt_time(), dt_timezone.utc)
+        elif options["older_than_days"] is not None:
+            cutoff = default_cutoff(options["older_than_days"])
+        else:
+            cutoff = default_cutoff()
+
+        started = time.perf_counter()
+
+        def progress(moved):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"contracts: {moved} archived ({elapsed:.1f}s)")
+
+        moved = archive_contracts(cutoff, options["batch_size"], progress=progress)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {moved} contracts created before {cutoff:%Y-%m-%d %H:%M}."
+            )
+        )
@@ -0,0 +1,83 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from user_contracts.api.operations import OPERATIONS
+from user_contracts.benchmark import HttpTransport, InProcessTransport, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay representative GraphQL operations and report throughput, "
+        "latency percentiles and SQL counts as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--operation",
+            action="append",
+            dest="operations",
+            choices=sorted(OPERATIONS),
+            help="Operation to run (can be repeated), all of them by default.",
+        )
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument(
+            "--url",
+            help="GraphQL endpoint of a running server, e.g. "
+            "http://localhost:8000/graphql/. Runs in-process when omitted.",
+        )
+        parser.add_argument("--metrics-url")
+        parser.add_argument("--token", help="JWT sent as a Bearer token.")
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+        parser.add_argument(
+            "--admission",
+            action="store_true",
+            help="Keep the rate limit and the concurrency limit in-process. "
+            "All the requests share one client, so most are rejected.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be positive.")
+
+        if options["url"]:
+            transport = HttpTransport(
+                options["url"], options["token"], options["metrics_url"]
+            )
+        else:
+            transport = InProcessTransport(options["token"], options["admission"])
+
+        names = options["operations"] or list(OPERATIONS)
+        report = run_benchmark(
+            transport,
+            [OPERATIONS[name] for name in names],
+            requests=options["requests"],
+            concurrency=options["concurrency"],
+            warmup=options["warmup"],
+        )
+
+        for name, result in report["operations"].items():
+            latency = result["latency_ms"]
+            self.stderr.write(
+                f"{name}: {result['throughput_rps']} req/s, "
+                f"p50 {latency['p50']}ms p95 {latency['p95']}ms "
+                f"p99 {latency['p99']}ms, {result['errors']} errors"
+            )
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        failed = {
+            name: result["errors"]
+            for name, result in report["operations"].items()
+            if result["errors"]
+        }
+        if failed:
+            raise CommandError(
+                "Requests failed, the results only time the others: "
+                + ", ".join(f"{name} {count}" for name, count in failed.items())
+            )
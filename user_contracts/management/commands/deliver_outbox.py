@@ -0,0 +1,47 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from user_contracts.outbox import deliver_pending, endpoint_url, purge_delivered
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver the contract change events of the outbox to OUTBOX_ENDPOINT_URL "
+        "in compressed batches. Run a single instance."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when no event is due.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Deliver the events due and exit instead of polling.",
+        )
+        parser.add_argument(
+            "--purge-after-days",
+            type=int,
+            help="Delete the events delivered more than this many days ago.",
+        )
+
+    def handle(self, *args, **options):
+        if not endpoint_url():
+            raise CommandError("Set OUTBOX_ENDPOINT_URL first.")
+        while True:
+            delivered = deliver_pending(options["batch_size"])
+            if delivered:
+                self.stdout.write(f"Delivered {delivered} events.")
+            if options["purge_after_days"] is not None:
+                purge_delivered(
+                    timezone.now() - timedelta(days=options["purge_after_days"])
+                )
+            if options["once"]:
+                return
+            if not delivered:
+                time.sleep(options["poll_interval"])
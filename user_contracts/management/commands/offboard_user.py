@@ -0,0 +1,81 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from user_contracts.models import UserOffboarding
+from user_contracts.offboarding import (
+    run_offboarding,
+    run_unfinished,
+    start_offboarding,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Deactivate users, then delete their contracts by chunks and finally "
+        "the users themselves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="*", type=int)
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Also resume the offboardings that did not finish.",
+        )
+        parser.add_argument(
+            "--worker",
+            action="store_true",
+            help=(
+                "Keep running the offboardings that did not finish, such as "
+                "those started by the offboardUser mutation. Run a single "
+                "instance."
+            ),
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait between runs of the worker.",
+        )
+        parser.add_argument("--chunk-size", type=int)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            help="Seconds to wait between chunks.",
+        )
+
+    def handle(self, *args, **options):
+        if options["worker"]:
+            while True:
+                run_unfinished(options["chunk_size"], options["pause"])
+                time.sleep(options["poll_interval"])
+
+        offboardings = []
+        for user_id in options["user_ids"]:
+            user = User.objects.filter(pk=user_id).first()
+            if user is None:
+                raise CommandError(f"User with ID {user_id} does not exist.")
+            offboardings.append(start_offboarding(user))
+        if options["resume"]:
+            offboardings += UserOffboarding.objects.exclude(
+                status=UserOffboarding.DONE
+            ).exclude(pk__in=[offboarding.pk for offboarding in offboardings])
+        if not offboardings:
+            raise CommandError("Pass user ids or --resume.")
+
+        def progress(offboarding):
+            self.stdout.write(
+                f"{offboarding.username}: {offboarding.contracts_deleted}/"
+                f"{offboarding.contracts_total} contracts deleted"
+            )
+
+        for offboarding in offboardings:
+            if offboarding.status == UserOffboarding.DONE:
+                continue
+            run_offboarding(
+                offboarding,
+                size=options["chunk_size"],
+                pause=options["pause"],
+                progress=progress,
+            )
+            self.stdout.write(self.style.SUCCESS(f"Offboarded {offboarding.username}."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from user_contracts import changes
+from user_contracts.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user contract summaries from the contracts table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            action="append",
+            type=int,
+            dest="user_ids",
+            help="Only rebuild the summary of this user id (can be repeated).",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        written = rebuild_summaries(
+            user_ids=options["user_ids"], batch_size=options["batch_size"]
+        )
+        changes.bulk_changed()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} summaries."))
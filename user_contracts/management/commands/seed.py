@@ -0,0 +1,57 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from user_contracts.seeding import SEED_PASSWORD, SIZES, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate users and contracts with bulk inserts, either a preset size "
+        "or explicit counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", choices=sorted(SIZES), help="Preset size.")
+        parser.add_argument("--users", type=int)
+        parser.add_argument("--contracts", type=int)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=3 * 365,
+            help="Spread the contracts creation dates over this many days.",
+        )
+        parser.add_argument("--random-seed", type=int)
+
+    def handle(self, *args, **options):
+        users, contracts = SIZES.get(options["size"], (None, None))
+        users = options["users"] if options["users"] is not None else users
+        if options["contracts"] is not None:
+            contracts = options["contracts"]
+        if not users:
+            raise CommandError("Pass --size or --users (and --contracts).")
+        contracts = contracts or 0
+
+        if options["random_seed"] is not None:
+            random.seed(options["random_seed"])
+
+        started = time.perf_counter()
+
+        def progress(kind, done, total):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{kind}: {done}/{total} ({elapsed:.1f}s)")
+
+        seed(
+            users,
+            contracts,
+            batch_size=options["batch_size"],
+            days=options["days"],
+            progress=progress,
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {users} users and {contracts} contracts in {elapsed:.1f}s. "
+                f"Users can log in with the password {SEED_PASSWORD!r}."
+            )
+        )
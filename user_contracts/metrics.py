@@ -0,0 +1,414 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+logger = logging.getLogger(__name__)
+
+
+class _ThreadShards:
+    """
+    One dictionary per thread holding the values a metric recorded on that
+    thread.
+
+    A shard is only ever written by its own thread, so recording a value
+    takes no lock; the lock is only taken the first time a thread records
+    something and when the shards are collected for rendering.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def get(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def collect(self):
+        with self._lock:
+            shards = list(self._shards)
+        return [dict(shard) for shard in shards]
+
+    def clear(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _ThreadShards()
+
+    def clear(self):
+        self._shards.clear()
+
+    def label_pairs(self, labels):
+        return tuple(zip(self.labelnames, labels))
+
+    def state(self):
+        """Return the values of the metric per label values."""
+        raise NotImplementedError
+
+    def merge(self, state, values, pid):
+        """
+        Add the `(labels, value)` pairs of a snapshot of process `pid` to
+        `state`.
+        """
+        raise NotImplementedError
+
+    def samples(self, state=None):
+        """
+        Return a list of `(suffix, label pairs, value)` to render, from
+        `state` when given, else from the values of the process.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A monotonically increasing value, per label values."""
+
+    type = "counter"
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shards.get()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        totals = {}
+        for shard in self._shards.collect():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def value(self, labels=()):
+        return self.values().get(labels, 0)
+
+    def state(self):
+        return self.values()
+
+    def merge(self, state, values, pid):
+        for labels, value in values:
+            labels = tuple(labels)
+            state[labels] = state.get(labels, 0) + value
+
+    def samples(self, state=None):
+        if state is None:
+            state = self.values()
+        return [
+            ("_total", self.label_pairs(labels), value)
+            for labels, value in state.items()
+        ]
+
+
+class Gauge(Metric):
+    """A value that is set rather than accumulated."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def set(self, labels=(), value=0):
+        self._values[labels] = value
+
+    def clear(self):
+        self._values.clear()
+
+    def state(self):
+        return dict(self._values)
+
+    def merge(self, state, values, pid):
+        # The values of several processes are not added up: each is
+        # exported with the pid of its process as an extra label.
+        for labels, value in values:
+            state[tuple(labels) + (pid,)] = value
+
+    def samples(self, state=None):
+        labelnames = self.labelnames
+        if state is None:
+            state = self.state()
+        else:
+            labelnames += ("pid",)
+        return [
+            ("", tuple(zip(labelnames, labels)), value)
+            for labels, value in state.items()
+        ]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets, per label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels=(), value=0):
+        shard = self._shards.get()
+        state = shard.get(labels)
+        if state is None:
+            # One count per bucket plus +Inf, then the sum of the values.
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def totals(self):
+        merged = {}
+        for shard in self._shards.collect():
+            for labels, state in shard.items():
+                total = merged.setdefault(labels, [0] * len(state))
+                for index, value in enumerate(state):
+                    total[index] += value
+        return merged
+
+    def state(self):
+        return self.totals()
+
+    def merge(self, state, values, pid):
+        for labels, counts in values:
+            total = state.setdefault(tuple(labels), [0] * len(counts))
+            for index, value in enumerate(counts):
+                total[index] += value
+
+    def samples(self, state=None):
+        if state is None:
+            state = self.totals()
+        samples = []
+        for labels, counts in state.items():
+            labels = self.label_pairs(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                samples.append(("_bucket", labels + (("le", bound),), cumulative))
+            samples.append(("_count", labels, cumulative))
+            samples.append(("_sum", labels, counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def clear(self):
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def snapshot(self):
+        """Return the values of every metric, as JSON-serializable data."""
+        return {
+            name: [[list(labels), value] for labels, value in metric.state().items()]
+            for name, metric in list(self._metrics.items())
+        }
+
+    def render(self, snapshots=None):
+        """
+        Render every metric in the Prometheus text exposition format, from
+        the values of the process, or merged from `snapshots`, a dict of
+        the snapshots of processes by pid.
+        """
+        lines = []
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            state = None
+            if snapshots is not None:
+                state = {}
+                for pid, snapshot in sorted(snapshots.items()):
+                    metric.merge(state, snapshot.get(metric.name, ()), pid)
+            for suffix, labels, value in metric.samples(state):
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+registry = Registry()
+
+
+# With several worker processes, each writes the snapshot of its metrics to
+# a file of METRICS_DIR every METRICS_FLUSH_INTERVAL seconds, and /metrics
+# renders the merge of all the files, whichever worker serves it.
+
+
+def metrics_dir():
+    return getattr(settings, "METRICS_DIR", "")
+
+
+def flush_interval():
+    return getattr(settings, "METRICS_FLUSH_INTERVAL", 5)
+
+
+_flush_lock = threading.Lock()
+
+# Name of the file holding the totals of the exited processes.
+DEAD = "dead"
+
+
+def _path(pid):
+    return os.path.join(metrics_dir(), f"{pid}.json")
+
+
+def _write(path, snapshot):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(snapshot, file)
+    os.replace(temporary, path)
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """
+    Write the snapshot of the metrics of the process to its file. Does
+    nothing without `METRICS_DIR`.
+    """
+    if not metrics_dir():
+        return
+    with _flush_lock:
+        _write(_path(os.getpid()), registry.snapshot())
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(flush_interval())
+        try:
+            flush()
+        except OSError:
+            logger.exception("Could not write the metrics of the process.")
+
+
+def start_flushing():
+    """
+    Flush the metrics of the process now, then every
+    `METRICS_FLUSH_INTERVAL` seconds from a daemon thread, so that idle
+    workers are reported too.
+    """
+    if not metrics_dir():
+        return
+    flush()
+    threading.Thread(
+        target=_flush_periodically, name="metrics-flush", daemon=True
+    ).start()
+
+
+def collect():
+    """
+    Return the snapshots of the processes by pid, the current one being
+    flushed first, or None without `METRICS_DIR`.
+    """
+    directory = metrics_dir()
+    if not directory:
+        return None
+    flush()
+    snapshots = {}
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            snapshot = _read(os.path.join(directory, name))
+            if snapshot is not None:
+                snapshots[name[: -len(".json")]] = snapshot
+    return snapshots
+
+
+def mark_process_dead(pid):
+    """
+    Fold the counters and histograms of an exited process into the
+    `dead.json` aggregate and remove its file, so the totals do not go back
+    when a worker is replaced while the directory keeps one file per live
+    worker. Its gauges are dropped.
+    """
+    if not metrics_dir():
+        return
+    path = _path(pid)
+    snapshot = _read(path)
+    if snapshot is not None:
+        aggregate = _read(_path(DEAD)) or {}
+        for name, values in snapshot.items():
+            metric = registry.get(name)
+            if metric is None or metric.type == "gauge":
+                continue
+            state = {}
+            metric.merge(state, aggregate.get(name, ()), DEAD)
+            metric.merge(state, values, pid)
+            aggregate[name] = [[list(labels), value] for labels, value in state.items()]
+        _write(_path(DEAD), aggregate)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def reset():
+    """Create `METRICS_DIR`, without the files of a previous run of the server."""
+    directory = metrics_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith((".json", ".tmp")):
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-19 16:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_summaries(apps, schema_editor):
+    Contract = apps.get_model("user_contracts", "Contract")
+    UserContractSummary = apps.get_model("user_contracts", "UserContractSummary")
+    totals = (
+        Contract.objects.order_by()
+        .values("user_id")
+        .annotate(
+            contract_count=models.Count("id"),
+            total_amount=models.Sum("amount"),
+            total_fidelity=models.Sum("fidelity"),
+        )
+    )
+    UserContractSummary.objects.bulk_create(
+        (UserContractSummary(**row) for row in totals.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("user_contracts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserContractSummary",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="contract_summary",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("contract_count", models.PositiveIntegerField(default=0)),
+                (
+                    "total_amount",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=16),
+                ),
+                ("total_fidelity", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations
+
+# Postgres: full-text and trigram GIN indexes on the description. They are
+# built concurrently so the migration does not lock a large contracts table.
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS user_contracts_contract_description_fts "
+    "ON user_contracts_contract USING gin (to_tsvector('english', description))",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS user_contracts_contract_description_trgm "
+    "ON user_contracts_contract USING gin (description gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX CONCURRENTLY IF EXISTS user_contracts_contract_description_trgm",
+    "DROP INDEX CONCURRENTLY IF EXISTS user_contracts_contract_description_fts",
+]
+
+# SQLite: an external content FTS5 table kept in sync with triggers.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE user_contracts_contract_fts USING fts5("
+    "description, content='user_contracts_contract', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER user_contracts_contract_fts_ai "
+    "AFTER INSERT ON user_contracts_contract BEGIN "
+    "INSERT INTO user_contracts_contract_fts(rowid, description) "
+    "VALUES (new.id, new.description); END",
+    "CREATE TRIGGER user_contracts_contract_fts_ad "
+    "AFTER DELETE ON user_contracts_contract BEGIN "
+    "INSERT INTO user_contracts_contract_fts(user_contracts_contract_fts, rowid, description) "
+    "VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER user_contracts_contract_fts_au "
+    "AFTER UPDATE OF description ON user_contracts_contract BEGIN "
+    "INSERT INTO user_contracts_contract_fts(user_contracts_contract_fts, rowid, description) "
+    "VALUES ('delete', old.id, old.description); "
+    "INSERT INTO user_contracts_contract_fts(rowid, description) "
+    "VALUES (new.id, new.description); END",
+    "INSERT INTO user_contracts_contract_fts(user_contracts_contract_fts) "
+    "VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS user_contracts_contract_fts_au",
+    "DROP TRIGGER IF EXISTS user_contracts_contract_fts_ad",
+    "DROP TRIGGER IF EXISTS user_contracts_contract_fts_ai",
+    "DROP TABLE IF EXISTS user_contracts_contract_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("user_contracts", "0002_usercontractsummary"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            _run({"postgresql": POSTGRES_BACKWARD, "sqlite": SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+# The index is built concurrently on Postgres so that adding it does not
+# block writes to a large contracts table.
+FORWARD = {
+    "postgresql": "CREATE INDEX CONCURRENTLY IF NOT EXISTS contract_created_at_idx "
+    "ON user_contracts_contract (created_at)",
+}
+BACKWARD = {
+    "postgresql": "DROP INDEX CONCURRENTLY IF EXISTS contract_created_at_idx",
+}
+DEFAULT_FORWARD = (
+    "CREATE INDEX contract_created_at_idx ON user_contracts_contract (created_at)"
+)
+DEFAULT_BACKWARD = "DROP INDEX contract_created_at_idx"
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    schema_editor.execute(FORWARD.get(vendor, DEFAULT_FORWARD))
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    schema_editor.execute(BACKWARD.get(vendor, DEFAULT_BACKWARD))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("user_contracts", "0004_dataversion"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="contract",
+                    index=models.Index(
+                        fields=["created_at"], name="contract_created_at_idx"
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_index, drop_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-19 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("user_contracts", "0007_outboxevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="useroffboarding",
+            name="last_archived_contract_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="ArchivedContract",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("description", models.CharField(max_length=255)),
+                ("created_at", models.DateTimeField()),
+                ("fidelity", models.IntegerField()),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_contracts",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="archivedcontract",
+            index=models.Index(fields=["created_at"], name="archived_created_at_idx"),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+
+def rename_stamps(apps, schema_editor):
+    # The stamps shared by all users become the stamps of the changes not
+    # tied to one user, so the versions keep growing from where they are.
+    DataVersion = apps.get_model("user_contracts", "DataVersion")
+    for name in ("users", "contracts"):
+        DataVersion.objects.filter(name=name).update(name=f"{name}:*")
+
+
+def merge_stamps(apps, schema_editor):
+    DataVersion = apps.get_model("user_contracts", "DataVersion")
+    for name in ("users", "contracts"):
+        stamps = DataVersion.objects.filter(name__startswith=f"{name}:")
+        version = stamps.aggregate(total=models.Sum("version"))["total"]
+        stamps.delete()
+        if version is not None:
+            DataVersion.objects.create(name=name, version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user_contracts", "0008_archivedcontract"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_stamps, merge_stamps),
+    ]
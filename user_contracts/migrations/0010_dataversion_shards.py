@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-19 19:10
+
+from django.db import migrations, models
+
+
+def create_shards(apps, schema_editor):
+    # The per-user stamps so far are carried over to the first shard, so
+    # the version of all the data keeps growing from where it is.
+    DataVersion = apps.get_model("user_contracts", "DataVersion")
+    for name in ("users", "contracts"):
+        version = (
+            DataVersion.objects.filter(name__startswith=f"{name}:")
+            .exclude(name=f"{name}:*")
+            .aggregate(total=models.Sum("version"))["total"]
+        )
+        if version:
+            DataVersion.objects.create(name=f"{name}:shard:0", version=version)
+
+
+def delete_shards(apps, schema_editor):
+    DataVersion = apps.get_model("user_contracts", "DataVersion")
+    for name in ("users", "contracts"):
+        DataVersion.objects.filter(name__startswith=f"{name}:shard:").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user_contracts", "0009_dataversion_per_user"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_shards, delete_shards),
+    ]
@@ -0,0 +1,62 @@
+from django.db import migrations, models
+
+# Offboarding deletes the contracts of a user in id order, chunk after
+# chunk, so both tables get an index on (user, id). They are built
+# concurrently on Postgres so that adding them does not block writes.
+INDEXES = [
+    ("contract_user_id_idx", "user_contracts_contract"),
+    ("archived_user_id_idx", "user_contracts_archivedcontract"),
+]
+
+
+def create_indexes(apps, schema_editor):
+    concurrently = (
+        " CONCURRENTLY IF NOT EXISTS"
+        if schema_editor.connection.vendor == "postgresql"
+        else ""
+    )
+    for name, table in INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX{concurrently} {name} ON {table} (user_id, id)"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    concurrently = (
+        " CONCURRENTLY IF EXISTS"
+        if schema_editor.connection.vendor == "postgresql"
+        else ""
+    )
+    for name, _ in INDEXES:
+        schema_editor.execute(f"DROP INDEX{concurrently} {name}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("user_contracts", "0010_dataversion_shards"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="contract",
+                    index=models.Index(
+                        fields=["user", "id"], name="contract_user_id_idx"
+                    ),
+                ),
+                migrations.AddIndex(
+                    model_name="archivedcontract",
+                    index=models.Index(
+                        fields=["user", "id"], name="archived_user_id_idx"
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user_contracts", "0011_contract_user_id_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="archivedcontract",
+            name="id",
+            field=models.BigIntegerField(primary_key=True, serialize=False),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 
 
 # Create your models here.
@@ -10,5 +11,181 @@ class Contract(models.Model):
     fidelity = models.IntegerField()
     amount = models.DecimalField(max_digits=10, decimal_places=2)
 
+    # Set on the contracts read from the archive (see `ArchivedContract`).
+    archived = False
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="contract_created_at_idx"),
+            models.Index(fields=["user", "id"], name="contract_user_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.description} - {self.user.username}"
+
+
+class ArchivedContract(models.Model):
+    """
+    A contract moved out of the contracts table once older than the
+    archive cutoff, with its original id (see `user_contracts.archive`).
+
+    Archived contracts still count in the summaries of their users, but
+    are only read when a query asks for the period they belong to.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    description = models.CharField(max_length=255)
+    user = models.ForeignKey(
+        User, related_name="archived_contracts", on_delete=models.CASCADE
+    )
+    created_at = models.DateTimeField()
+    fidelity = models.IntegerField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="archived_created_at_idx"),
+            models.Index(fields=["user", "id"], name="archived_user_id_idx"),
+        ]
+
+    def to_contract(self):
+        """Return the contract as an unsaved, read-only `Contract`."""
+        contract = Contract(
+            id=self.id,
+            description=self.description,
+            user_id=self.user_id,
+            created_at=self.created_at,
+            fidelity=self.fidelity,
+            amount=self.amount,
+        )
+        if ArchivedContract.user.is_cached(self):
+            contract.user = self.user
+        contract.archived = True
+        return contract
+
+    def __str__(self):
+        return f"{self.description} - {self.user_id} (archived)"
+
+
+class UserContractSummary(models.Model):
+    """
+    Denormalized per-user totals of the user's contracts.
+
+    Rows are kept up to date by the contract mutations (see
+    `user_contracts.summaries`) so that reading a user's contract count,
+    total amount and average fidelity is a primary-key lookup instead of
+    an aggregate over `Contract`.
+    """
+
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name="contract_summary",
+        on_delete=models.CASCADE,
+    )
+    contract_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    total_fidelity = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_fidelity(self):
+        if not self.contract_count:
+            return None
+        return self.total_fidelity / self.contract_count
+
+    def __str__(self):
+        return f"{self.user_id} - {self.contract_count} contracts"
+
+
+class DataVersion(models.Model):
+    """
+    Version stamp of a kind of data of a user, incremented by every change
+    to it. `name` is "<kind>:<user id>", or "<kind>:*" for the changes not
+    tied to one user. The changes of each user are also counted in one of
+    the "<kind>:shard:<n>" stamps, which add up to the version of all users.
+
+    The GraphQL view derives the ETags of GET queries from these stamps,
+    so an unchanged response is detected without executing the query.
+    """
+
+    name = models.CharField(max_length=32, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class UserOffboarding(models.Model):
+    """
+    Progress of the offboarding of a user: their contracts are deleted in
+    chunks, then the user row itself (see `user_contracts.offboarding`).
+
+    It refers to the user by id rather than by a foreign key so that it
+    outlives the user it describes.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    user_id = models.IntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    contracts_total = models.PositiveIntegerField(default=0)
+    contracts_deleted = models.PositiveIntegerField(default=0)
+    # Contracts, and archived contracts, up to these primary keys have been
+    # deleted.
+    last_contract_id = models.BigIntegerField(default=0)
+    last_archived_contract_id = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return (
+            f"{self.username} - {self.status} "
+            f"({self.contracts_deleted}/{self.contracts_total})"
+        )
+
+
+class OutboxEvent(models.Model):
+    """
+    A change to deliver to the downstream consumers, written in the
+    transaction of the change itself (see `user_contracts.outbox`).
+
+    Events are delivered in primary key order per user; an event failing
+    to be delivered holds back the later events of its user until
+    `next_attempt_at`.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=64)
+    user_id = models.IntegerField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(delivered_at__isnull=True),
+                name="outbox_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id}"
@@ -0,0 +1,163 @@
+import logging
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from user_contracts import changes
+from user_contracts.models import ArchivedContract, Contract, UserOffboarding
+
+logger = logging.getLogger(__name__)
+
+
+# The tables holding the contracts of a user, with the offboarding field
+# recording up to which id they were deleted.
+CONTRACT_TABLES = [
+    (Contract, "last_contract_id"),
+    (ArchivedContract, "last_archived_contract_id"),
+]
+
+
+def chunk_size():
+    return getattr(settings, "OFFBOARDING_CHUNK_SIZE", 1000)
+
+
+def chunk_pause():
+    return getattr(settings, "OFFBOARDING_CHUNK_PAUSE", 0)
+
+
+def start_offboarding(user):
+    """
+    Deactivate `user` and record their offboarding, or return the one
+    already recorded. The user can no longer authenticate from then on;
+    their contracts are deleted by `run_offboarding`.
+    """
+    with transaction.atomic():
+        offboarding, _ = UserOffboarding.objects.get_or_create(
+            user_id=user.pk,
+            defaults={
+                "username": user.username,
+                "contracts_total": sum(
+                    model.objects.filter(user=user).count()
+                    for model, _ in CONTRACT_TABLES
+                ),
+            },
+        )
+        if user.is_active:
+            user.is_active = False
+            user.save(update_fields=["is_active"])
+            changes.user_changed(user)
+    return offboarding
+
+
+def is_being_offboarded(user):
+    """Whether an offboarding of `user` is recorded and not done yet."""
+    return (
+        UserOffboarding.objects.filter(user_id=user.pk)
+        .exclude(status=UserOffboarding.DONE)
+        .exists()
+    )
+
+
+def delete_contract_chunk(offboarding, size, model=Contract, cursor="last_contract_id"):
+    """
+    Delete the next `size` contracts of the user from the table of `model`
+    in a transaction of their own, together with the summary update and
+    the progress, and return how many were deleted.
+    """
+    with transaction.atomic():
+        rows = list(
+            model.objects.select_for_update()
+            .filter(user_id=offboarding.user_id, pk__gt=getattr(offboarding, cursor))
+            .order_by("pk")
+            .values_list("pk", "amount", "fidelity")[:size]
+        )
+        if not rows:
+            return 0
+        ids = [pk for pk, _, _ in rows]
+        model.objects.filter(pk__in=ids).delete()
+        changes.contracts_deleted(
+            offboarding.user_id,
+            ids,
+            amount=sum((Decimal(amount) for _, amount, _ in rows), Decimal("0")),
+            fidelity=sum(fidelity for _, _, fidelity in rows),
+        )
+        offboarding.contracts_deleted += len(ids)
+        setattr(offboarding, cursor, ids[-1])
+        offboarding.save(update_fields=["contracts_deleted", cursor, "updated_at"])
+    return len(ids)
+
+
+def delete_user(offboarding):
+    """Delete the user row once no contract refers to it anymore."""
+    with transaction.atomic():
+        user = User.objects.select_for_update().filter(pk=offboarding.user_id).first()
+        if user is not None:
+            if any(
+                model.objects.filter(user=user).exists() for model, _ in CONTRACT_TABLES
+            ):
+                # Contracts were archived since their chunks were deleted.
+                return False
+            changes.user_changed(user)
+            user.delete()
+        offboarding.status = UserOffboarding.DONE
+        offboarding.finished_at = timezone.now()
+        offboarding.save(update_fields=["status", "finished_at", "updated_at"])
+    return True
+
+
+def run_offboarding(offboarding, size=None, pause=None, progress=None):
+    """
+    Delete the contracts of the offboarded user by chunks of `size`,
+    oldest first and archived ones included, then the user row.
+
+    Every chunk is its own short transaction, so locks are only held for
+    one chunk and the work can be resumed from the last ids deleted after
+    an interruption. `pause` seconds are waited between chunks to leave room
+    to the other writes. `progress` is called with the offboarding after
+    every chunk.
+    """
+    size = size or chunk_size()
+    pause = chunk_pause() if pause is None else pause
+    offboarding.status = UserOffboarding.RUNNING
+    offboarding.error = ""
+    offboarding.save(update_fields=["status", "error", "updated_at"])
+    try:
+        while True:
+            for model, cursor in CONTRACT_TABLES:
+                while delete_contract_chunk(offboarding, size, model, cursor):
+                    if progress:
+                        progress(offboarding)
+                    if pause:
+                        time.sleep(pause)
+            if delete_user(offboarding):
+                break
+            # Contracts were archived meanwhile, possibly below the cursor.
+            for _, cursor in CONTRACT_TABLES:
+                setattr(offboarding, cursor, 0)
+    except Exception as e:
+        offboarding.status = UserOffboarding.FAILED
+        offboarding.error = str(e)
+        offboarding.save(update_fields=["status", "error", "updated_at"])
+        raise
+    if progress:
+        progress(offboarding)
+    return offboarding
+
+
+def run_unfinished(size=None, pause=None, progress=None):
+    """
+    Run every offboarding that did not finish, oldest first, and return how
+    many were run. A failure is recorded on its offboarding and logged, and
+    the offboarding is resumed from its cursors by the next call.
+    """
+    offboardings = UserOffboarding.objects.exclude(status=UserOffboarding.DONE)
+    ran = 0
+    for offboarding in offboardings.order_by("pk"):
+        try:
+            run_offboarding(offboarding, size, pause, progress)
+        except Exception:
+            logger.exception("Offboarding %s failed.", offboarding.pk)
+        ran += 1
+    return ran
@@ -0,0 +1,184 @@
+import gzip
+import logging
+import urllib.request
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from user_contracts.metrics import registry
+from user_contracts.models import OutboxEvent
+from user_contracts.serialization import dumps
+
+CONTRACT_CREATED = "contract.created"
+CONTRACT_UPDATED = "contract.updated"
+CONTRACT_DELETED = "contract.deleted"
+
+EVENTS_DELIVERED = registry.counter(
+    "outbox_events_delivered", "Outbox events delivered to the endpoint."
+)
+DELIVERY_FAILURES = registry.counter(
+    "outbox_delivery_failures", "Outbox batches the endpoint did not accept."
+)
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint_url():
+    return getattr(settings, "OUTBOX_ENDPOINT_URL", "")
+
+
+def endpoint_token():
+    return getattr(settings, "OUTBOX_ENDPOINT_TOKEN", "")
+
+
+def batch_size():
+    return getattr(settings, "OUTBOX_BATCH_SIZE", 500)
+
+
+def request_timeout():
+    return getattr(settings, "OUTBOX_TIMEOUT", 10)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt, doubling up to a maximum."""
+    base = getattr(settings, "OUTBOX_RETRY_BASE_DELAY", 1)
+    return min(
+        getattr(settings, "OUTBOX_RETRY_MAX_DELAY", 300), base * 2 ** (attempts - 1)
+    )
+
+
+def contract_payload(contract):
+    return {
+        "id": contract.pk,
+        "user_id": contract.user_id,
+        "description": contract.description,
+        "fidelity": contract.fidelity,
+        # As stored, the field may hold the unrounded value of the input.
+        "amount": Decimal(str(contract.amount)).quantize(Decimal("0.01")),
+        "created_at": contract.created_at,
+    }
+
+
+def record(event_type, contract):
+    """
+    Write the event of a contract change and return it. Call it in the
+    transaction of the change, so the event exists if and only if the
+    change was committed.
+    """
+    return OutboxEvent.objects.create(
+        event_type=event_type,
+        user_id=contract.user_id,
+        payload=contract_payload(contract),
+    )
+
+
+def record_deleted(user_id, contract_ids):
+    """Write the deletion events of contracts deleted in bulk."""
+    return OutboxEvent.objects.bulk_create(
+        [
+            OutboxEvent(
+                event_type=CONTRACT_DELETED,
+                user_id=user_id,
+                payload={"id": contract_id, "user_id": user_id},
+            )
+            for contract_id in contract_ids
+        ]
+    )
+
+
+def next_batch(size, now):
+    """
+    Return the oldest events due for delivery, skipping every user with an
+    earlier event waiting to be retried so their events stay in order.
+    """
+    pending = OutboxEvent.objects.filter(delivered_at__isnull=True)
+    waiting_users = pending.filter(next_attempt_at__gt=now).values("user_id")
+    return list(
+        pending.filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        .exclude(user_id__in=waiting_users)
+        .order_by("id")[:size]
+    )
+
+
+def encode_batch(events):
+    """Gzipped JSON body holding the events in order."""
+    return gzip.compress(
+        dumps(
+            {
+                "events": [
+                    {
+                        "id": event.id,
+                        "type": event.event_type,
+                        "user_id": event.user_id,
+                        "created_at": event.created_at,
+                        "payload": event.payload,
+                    }
+                    for event in events
+                ]
+            }
+        ),
+        compresslevel=5,
+    )
+
+
+def post_batch(events):
+    """POST the events to the endpoint, raising unless it accepts them."""
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    if endpoint_token():
+        headers["Authorization"] = f"Bearer {endpoint_token()}"
+    request = urllib.request.Request(
+        endpoint_url(), data=encode_batch(events), headers=headers, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=request_timeout()) as response:
+        response.read()
+
+
+def deliver_pending(size=None):
+    """
+    Deliver the events due, batch after batch, and return the number
+    delivered. Stops at the first batch the endpoint refuses, whose events
+    are scheduled for a later attempt.
+
+    Delivery is at least once: an event may be sent again if the process
+    stops between the POST and the update, consumers deduplicate them by
+    `id`. A single worker must run at a time to keep the order per user.
+    """
+    if not endpoint_url():
+        raise ValueError("OUTBOX_ENDPOINT_URL is not set.")
+    size = size or batch_size()
+    delivered = 0
+    while True:
+        now = timezone.now()
+        events = next_batch(size, now)
+        if not events:
+            return delivered
+        ids = [event.id for event in events]
+        try:
+            post_batch(events)
+        except Exception as e:
+            DELIVERY_FAILURES.inc()
+            logger.warning("Delivering outbox events failed: %s", e)
+            with transaction.atomic():
+                for event in events:
+                    event.attempts += 1
+                    event.next_attempt_at = now + timedelta(
+                        seconds=retry_delay(event.attempts)
+                    )
+                    event.last_error = str(e)
+                OutboxEvent.objects.bulk_update(
+                    events, ["attempts", "next_attempt_at", "last_error"]
+                )
+            return delivered
+        OutboxEvent.objects.filter(id__in=ids).update(
+            delivered_at=timezone.now(), last_error=""
+        )
+        EVENTS_DELIVERED.inc(amount=len(ids))
+        delivered += len(ids)
+
+
+def purge_delivered(older_than):
+    """Delete the events delivered before `older_than`."""
+    deleted, _ = OutboxEvent.objects.filter(delivered_at__lt=older_than).delete()
+    return deleted
@@ -0,0 +1,89 @@
+import re
+from django.db import connection
+from user_contracts.models import Contract
+
+FTS_TABLE = "user_contracts_contract_fts"
+
+# The expression must match the one of the GIN index created in
+# migration 0003 so that Postgres can use it.
+POSTGRES_SEARCH_SQL = """
+    SELECT c.id,
+           ts_rank(to_tsvector('english', c.description), q.query)
+           + similarity(c.description, %s) AS rank
+    FROM user_contracts_contract c,
+         websearch_to_tsquery('english', %s) AS q(query)
+    WHERE to_tsvector('english', c.description) @@ q.query
+       OR c.description %% %s
+    ORDER BY rank DESC, c.id DESC
+    LIMIT %s OFFSET %s
+"""
+
+SQLITE_SEARCH_SQL = f"""
+    SELECT rowid, -bm25({FTS_TABLE}) AS rank
+    FROM {FTS_TABLE}
+    WHERE {FTS_TABLE} MATCH %s
+    ORDER BY bm25({FTS_TABLE}), rowid DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+def _fts5_match_expression(text):
+    """
+    Turn free text into an FTS5 expression matching every word as a prefix,
+    so that partially typed words still find their contracts.
+    """
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_contract_ids(text, limit, offset=0):
+    """
+    Return a list of `(contract_id, rank)` tuples matching `text`, best
+    match first.
+
+    Postgres uses full-text search combined with trigram similarity, so
+    misspelled words still match; SQLite uses the FTS5 table kept in sync
+    by triggers. Both are backed by indexes created in migration 0003.
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+
+    if connection.vendor == "postgresql":
+        sql, params = POSTGRES_SEARCH_SQL, [text, text, text, limit, offset]
+    elif connection.vendor == "sqlite":
+        expression = _fts5_match_expression(text)
+        if not expression:
+            return []
+        sql, params = SQLITE_SEARCH_SQL, [expression, limit, offset]
+    else:
+        ids = (
+            Contract.objects.filter(description__icontains=text)
+            .order_by("-id")
+            .values_list("id", flat=True)[offset : offset + limit]
+        )
+        return [(contract_id, 0.0) for contract_id in ids]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(contract_id, float(rank)) for contract_id, rank in cursor.fetchall()]
+
+
+def search_contracts(text, first, offset=0):
+    """
+    Return a page of `(contract, rank)` tuples matching `text` and a flag
+    telling whether more results are available after this page.
+    """
+    rows = search_contract_ids(text, limit=first + 1, offset=offset)
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+
+    contracts = Contract.objects.select_related("user").in_bulk(
+        [contract_id for contract_id, _ in rows]
+    )
+    page = [
+        (contracts[contract_id], rank)
+        for contract_id, rank in rows
+        if contract_id in contracts
+    ]
+    return page, has_next_page
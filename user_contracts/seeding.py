@@ -0,0 +1,130 @@
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from user_contracts import changes
+from user_contracts.models import Contract
+from user_contracts.summaries import rebuild_summaries
+
+# Number of users and contracts created by each preset of `manage.py seed`.
+SIZES = {
+    "1k": (100, 1_000),
+    "100k": (10_000, 100_000),
+    "10m": (1_000_000, 10_000_000),
+}
+
+SEED_PASSWORD = "password123"
+
+WORDS = [
+    "solar",
+    "wind",
+    "battery",
+    "storage",
+    "maintenance",
+    "installation",
+    "residential",
+    "commercial",
+    "panel",
+    "inverter",
+    "grid",
+    "supply",
+    "monitoring",
+    "charging",
+    "station",
+    "heat",
+    "pump",
+    "upgrade",
+]
+FIDELITIES = [6, 12, 24, 36, 48]
+
+
+@contextmanager
+def explicit_created_at():
+    """
+    Let `Contract.created_at` be set by the caller instead of `auto_now_add`,
+    so seeded contracts are spread over time like real ones.
+    """
+    field = Contract._meta.get_field("created_at")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def _batches(total, batch_size):
+    for start in range(0, total, batch_size):
+        yield start, min(batch_size, total - start)
+
+
+def seed_users(count, batch_size=5000, progress=None):
+    """
+    Bulk create `count` users sharing the `SEED_PASSWORD` and return their ids.
+
+    The password is hashed once, hashing it per user would dominate the
+    time of large seeds.
+    """
+    prefix = f"seed-{uuid.uuid4().hex[:8]}"
+    password = make_password(SEED_PASSWORD)
+    for start, size in _batches(count, batch_size):
+        User.objects.bulk_create(
+            [
+                User(
+                    username=f"{prefix}-{index}",
+                    email=f"{prefix}-{index}@example.com",
+                    password=password,
+                )
+                for index in range(start, start + size)
+            ]
+        )
+        if progress:
+            progress("users", start + size, count)
+    return list(
+        User.objects.filter(username__startswith=f"{prefix}-")
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def seed_contracts(user_ids, count, batch_size=5000, days=3 * 365, progress=None):
+    """
+    Bulk create `count` contracts owned by random users of `user_ids`, created
+    over the last `days` days.
+    """
+    now = timezone.now()
+    with explicit_created_at():
+        for start, size in _batches(count, batch_size):
+            contracts = [
+                Contract(
+                    description=" ".join(random.sample(WORDS, 3)).capitalize(),
+                    user_id=random.choice(user_ids),
+                    created_at=now - timedelta(seconds=random.randrange(days * 86400)),
+                    fidelity=random.choice(FIDELITIES),
+                    amount=Decimal(random.randrange(1_000, 500_000)) / 100,
+                )
+                for _ in range(size)
+            ]
+            with transaction.atomic():
+                Contract.objects.bulk_create(contracts)
+            if progress:
+                progress("contracts", start + size, count)
+
+
+def seed(users, contracts, batch_size=5000, days=3 * 365, progress=None):
+    """
+    Create `users` users and `contracts` contracts, then rebuild the
+    per-user summaries the bulk inserts bypassed.
+    """
+    user_ids = seed_users(users, batch_size=batch_size, progress=progress)
+    if contracts:
+        seed_contracts(
+            user_ids, contracts, batch_size=batch_size, days=days, progress=progress
+        )
+    rebuild_summaries(batch_size=batch_size)
+    changes.bulk_changed()
+    return user_ids
@@ -0,0 +1,124 @@
+import json
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Size of the slices of the body fed to the compressor, and so of the
+# chunks of a streamed compressed response.
+CHUNK_SIZE = 64 * 1024
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """
+    Encode `data` to compact JSON bytes.
+
+    Uses orjson when it is installed, which encodes straight to bytes and
+    handles datetimes natively; `Decimal` values are written as strings,
+    like the GraphQL `Decimal` scalar does.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def compression_min_bytes():
+    return getattr(settings, "GRAPHQL_COMPRESSION_MIN_BYTES", 1024)
+
+
+def accepted_encodings(request):
+    """Return the content codings the client accepts, with their q-values."""
+    encodings = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            encodings[coding.lower()] = quality
+    return encodings
+
+
+def negotiate_encoding(request):
+    """Pick brotli, when installed, or gzip if the client accepts it."""
+    encodings = accepted_encodings(request)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    for coding in candidates:
+        if encodings.get(coding, encodings.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def _compressor(coding):
+    if coding == "br":
+        compressor = brotli.Compressor(quality=4)
+        return compressor.process, compressor.finish
+    # A gzip container around a fast deflate stream.
+    compressor = zlib.compressobj(5, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _compressed_chunks(content, coding):
+    compress, finish = _compressor(coding)
+    view = memoryview(content)
+    for start in range(0, len(view), CHUNK_SIZE):
+        chunk = compress(view[start : start + CHUNK_SIZE])
+        if chunk:
+            yield chunk
+    yield finish()
+
+
+def compress_response(request, response):
+    """
+    Return a streamed, compressed copy of `response` when it is large enough
+    and the client accepts gzip or brotli, otherwise `response` itself.
+    """
+    if (
+        response.streaming
+        or response.status_code != 200
+        or response.has_header("Content-Encoding")
+        or len(response.content) < compression_min_bytes()
+    ):
+        return response
+
+    coding = negotiate_encoding(request)
+    if coding is None:
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    compressed = StreamingHttpResponse(
+        _compressed_chunks(response.content, coding),
+        status=response.status_code,
+        content_type=response["Content-Type"],
+    )
+    for header, value in response.items():
+        if header.lower() not in ("content-type", "content-length"):
+            compressed[header] = value
+    compressed.cookies = response.cookies
+    compressed["Content-Encoding"] = coding
+    patch_vary_headers(compressed, ("Accept-Encoding",))
+    return compressed
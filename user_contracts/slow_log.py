@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+from django.conf import settings
+
+logger = logging.getLogger("user_contracts.slow_operations")
+
+
+def slow_operation_threshold():
+    """Duration in seconds above which an operation is logged."""
+    return getattr(settings, "GRAPHQL_SLOW_OPERATION_MS", 500) / 1000
+
+
+def operation_hash(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+def variables_shape(value):
+    """
+    Describe the structure of the variables of an operation without their
+    values, which may hold personal data.
+    """
+    if isinstance(value, dict):
+        return {key: variables_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [variables_shape(value[0])] if value else []
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "Boolean"
+    if isinstance(value, int):
+        return "Int"
+    if isinstance(value, float):
+        return "Float"
+    return "String"
+
+
+def build_entry(stats, query, variables, reason):
+    return {
+        "reason": reason,
+        "operation_hash": operation_hash(query),
+        "operation_name": stats.operation_name,
+        "duration_ms": round(stats.duration * 1000, 3),
+        "variables": variables_shape(variables or {}),
+        "sql_queries": stats.sql_queries,
+        "db_time_ms": round(stats.db_time * 1000, 3),
+        "resolvers": {
+            field: {"calls": calls, "total_ms": round(total * 1000, 3)}
+            for field, (calls, total) in stats.field_timings.items()
+        },
+        "sql": [
+            {"sql": sql, "duration_ms": round(duration * 1000, 3), "rows": rows}
+            for sql, duration, rows in stats.sql_statements
+        ],
+    }
+
+
+def log_operation(stats, query, variables):
+    """
+    Write a JSON line describing the operation when it was slower than the
+    threshold, or when it was picked by head-based sampling.
+    """
+    if stats.duration >= slow_operation_threshold():
+        reason = "slow"
+    elif stats.log_sampled:
+        reason = "sampled"
+    else:
+        return
+    logger.info(json.dumps(build_entry(stats, query, variables, reason)))
@@ -0,0 +1,475 @@
+import asyncio
+import json
+import logging
+import re
+import select
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_payload, get_user_by_payload
+from user_contracts import entity_cache
+from user_contracts.metrics import registry
+from user_contracts.models import OutboxEvent
+from user_contracts.serialization import dumps
+
+# Path of the event stream of the contracts of a user.
+STREAM_PATH = re.compile(r"^/users/(?P<user_id>\d+)/contracts/stream/?$")
+
+# Milliseconds clients wait before reconnecting after a stream ends.
+RECONNECT_DELAY = 3000
+
+STREAM_CONNECTIONS = registry.gauge(
+    "contract_stream_connections", "Contract event streams open in this process."
+)
+STREAM_EVENTS_SENT = registry.counter(
+    "contract_stream_events_sent", "Contract events sent to the event streams."
+)
+
+logger = logging.getLogger(__name__)
+
+
+def backend_name():
+    return getattr(settings, "CONTRACT_STREAM_BACKEND", "local")
+
+
+def queue_size():
+    return getattr(settings, "CONTRACT_STREAM_QUEUE_SIZE", 100)
+
+
+def keepalive_interval():
+    return getattr(settings, "CONTRACT_STREAM_KEEPALIVE", 15)
+
+
+def max_connections():
+    return getattr(settings, "CONTRACT_STREAM_MAX_CONNECTIONS", 10_000)
+
+
+def replay_limit():
+    return getattr(settings, "CONTRACT_STREAM_REPLAY_LIMIT", 1000)
+
+
+def replay_window():
+    return getattr(settings, "CONTRACT_STREAM_REPLAY_WINDOW", 60)
+
+
+def stream_event(event):
+    """
+    The stream event of an outbox event, in the form the outbox delivers
+    it, its payload encoded as it is stored.
+    """
+    return {
+        "id": event.id,
+        "type": event.event_type,
+        "user_id": event.user_id,
+        "created_at": event.created_at.isoformat(),
+        "payload": json.loads(json.dumps(event.payload, cls=DjangoJSONEncoder)),
+    }
+
+
+def format_event(event):
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (
+        event["id"],
+        event["type"].encode(),
+        dumps(event),
+    )
+
+
+class Subscription:
+    """
+    The events of a user waiting to be sent to one stream. It belongs to
+    the event loop of the stream, `put` must be called from it.
+    """
+
+    def __init__(self, user_id, loop, size):
+        self.user_id = user_id
+        self.loop = loop
+        self.size = size
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+
+    def put(self, event):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.size:
+            # The client does not keep up. Its stream ends once the queued
+            # events are sent, and it resumes from the last one it got.
+            self.overflowed = True
+            event = None
+        self.queue.put_nowait(event)
+
+
+class Broker:
+    """
+    Subscriptions of the streams of this process by user. Events can be
+    delivered from any thread, they are handed to the event loop of each
+    subscription.
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def count(self):
+        return self._count
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop(), queue_size())
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+            self._count += 1
+            STREAM_CONNECTIONS.set(value=self._count)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+            self._count -= 1
+            STREAM_CONNECTIONS.set(value=self._count)
+
+    def deliver(self, events):
+        with self._lock:
+            targets = [
+                (subscription, event)
+                for event in events
+                for subscription in self._subscriptions.get(event["user_id"], ())
+            ]
+        for subscription, event in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The loop of the stream was closed.
+                pass
+
+
+broker = Broker()
+
+
+class LocalBackend:
+    """Deliver the events to the streams of this process only."""
+
+    def start(self):
+        pass
+
+    def publish(self, events):
+        transaction.on_commit(lambda: broker.deliver(events))
+
+
+class PostgresBackend:
+    """
+    Deliver the events to the streams of every process through Postgres
+    LISTEN/NOTIFY. The notifications are sent once the transaction of the
+    change commits, and a failure to send them is only logged: streaming is
+    best effort and must not fail the write, clients catch up on the events
+    they missed from the outbox when they reconnect. Every process with
+    streams runs a thread listening to them, with a connection of its own;
+    events notified while it reconnects are only replayed to the clients
+    reconnecting with their last event id.
+    """
+
+    channel = "contract_events"
+    # Postgres refuses notification payloads of 8000 bytes or more.
+    max_payload = 7000
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.listen, daemon=True)
+                self._thread.start()
+
+    def payloads(self, events):
+        """Encode the events to as few notification payloads as possible."""
+        batch, size = [], 0
+        for event in events:
+            encoded = dumps(event)
+            if batch and size + len(encoded) + 1 > self.max_payload:
+                yield (b"[" + b",".join(batch) + b"]").decode()
+                batch, size = [], 0
+            batch.append(encoded)
+            size += len(encoded) + 1
+        if batch:
+            yield (b"[" + b",".join(batch) + b"]").decode()
+
+    def publish(self, events):
+        transaction.on_commit(lambda: self.notify(events))
+
+    def notify(self, events):
+        try:
+            with connection.cursor() as cursor:
+                for payload in self.payloads(events):
+                    cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, payload])
+        except Exception:
+            logger.exception("Notifying %d contract events failed.", len(events))
+
+    def listen(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Listening to the contract events failed.")
+            finally:
+                connection.close()
+            time.sleep(1)
+
+    def _listen(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        raw = connection.connection
+        while True:
+            if select.select([raw], [], [], 60) == ([], [], []):
+                continue
+            raw.poll()
+            while raw.notifies:
+                broker.deliver(json.loads(raw.notifies.pop(0).payload))
+
+
+BACKENDS = {
+    "local": LocalBackend(),
+    "postgres": PostgresBackend(),
+}
+
+
+def get_backend():
+    return BACKENDS[backend_name()]
+
+
+def publish(events):
+    """
+    Send outbox events to the streams of their users once the current
+    transaction commits. Call it in the transaction of the change.
+    """
+    if events:
+        get_backend().publish([stream_event(event) for event in events])
+
+
+class StreamRejected(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = list(headers)
+
+
+def get_header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def get_token(scope):
+    authorization = get_header(scope, b"authorization") or ""
+    prefix, _, token = authorization.partition(" ")
+    if prefix.lower() == jwt_settings.JWT_AUTH_HEADER_PREFIX.lower() and token:
+        return token
+    # Browsers' EventSource cannot send headers.
+    return parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+
+
+def get_last_event_id(scope):
+    try:
+        return int(get_header(scope, b"last-event-id"))
+    except (TypeError, ValueError):
+        return None
+
+
+def missed_events(user_id, last_event_id):
+    """
+    The events of the user a client may have missed since the event
+    `last_event_id`, None when there are more than the replay limit.
+
+    Outbox ids are assigned when the events are written, not when they
+    commit, so an event committed after the last one the client got can
+    have a lower id. The events written up to `CONTRACT_STREAM_REPLAY_WINDOW`
+    seconds before that one are sent again, clients drop the ids they
+    already have.
+    """
+    events = OutboxEvent.objects.filter(user_id=user_id)
+    missed = Q(id__gt=last_event_id)
+    last_created_at = (
+        events.filter(id=last_event_id).values_list("created_at", flat=True).first()
+    )
+    if last_created_at is not None:
+        missed |= Q(
+            id__lt=last_event_id,
+            created_at__gte=last_created_at - timedelta(seconds=replay_window()),
+        )
+    missed = list(events.filter(missed).order_by("id")[: replay_limit() + 1])
+    if len(missed) > replay_limit():
+        return None
+    return [stream_event(event) for event in missed]
+
+
+def open_stream(token, user_id, last_event_id):
+    """
+    Authenticate the client and check it may follow the contracts of the
+    user, its own unless it is staff, then return the expiry of the token
+    and the events to replay, None when there are too many missed events to
+    replay.
+    """
+    try:
+        if token is None:
+            raise StreamRejected(401, "Authentication required.")
+        try:
+            payload = get_payload(token)
+            client = get_user_by_payload(payload)
+        except JSONWebTokenError as e:
+            raise StreamRejected(401, str(e))
+        if client is None:
+            raise StreamRejected(401, "User not found.")
+        if client.pk != user_id and not client.is_staff:
+            raise StreamRejected(403, "Not allowed to follow this user.")
+        if entity_cache.users.get(user_id) is None:
+            raise StreamRejected(404, "User not found.")
+        if last_event_id is None:
+            return payload.get("exp"), []
+        return payload.get("exp"), missed_events(user_id, last_event_id)
+    finally:
+        close_old_connections()
+
+
+async def respond(send, status, message, headers=()):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8"), *headers],
+        }
+    )
+    await send({"type": "http.response.body", "body": message.encode()})
+
+
+async def wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_contract_events(scope, receive, send, user_id):
+    """
+    Serve the server-sent event stream of the contract changes of a user,
+    to the user themselves or to staff.
+
+    Every change is sent as an event named after its type, with the id of
+    its outbox event. Clients reconnecting with `Last-Event-ID` first get
+    the changes they missed, read from the outbox (see `missed_events`), or
+    a `reset` event when there are more than `CONTRACT_STREAM_REPLAY_LIMIT`,
+    meaning they must fetch the contracts again. An event may be sent more
+    than once, clients drop the ids they already have. A comment is sent every
+    `CONTRACT_STREAM_KEEPALIVE` seconds of silence. The stream ends when
+    the token of the client expires.
+
+    An idle stream is a queue and two pending tasks, without a thread, so
+    a process holds thousands of them; beyond
+    `CONTRACT_STREAM_MAX_CONNECTIONS` new ones are refused.
+    """
+    if scope["method"] != "GET":
+        await respond(send, 405, "Method not allowed.", [(b"allow", b"GET")])
+        return
+    if broker.count() >= max_connections():
+        await respond(send, 503, "Too many streams.", [(b"retry-after", b"5")])
+        return
+    get_backend().start()
+    subscription = broker.subscribe(user_id)
+    getter = None
+    disconnect = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        try:
+            expires_at, replayed = await sync_to_async(open_stream)(
+                get_token(scope), user_id, get_last_event_id(scope)
+            )
+        except StreamRejected as e:
+            await respond(send, e.status, str(e), e.headers)
+            return
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    # Keeps nginx from buffering the events.
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        body = [b"retry: %d\n\n" % RECONNECT_DELAY]
+        if replayed is None:
+            body.append(b"event: reset\ndata: {}\n\n")
+            replayed = []
+        body.extend(format_event(event) for event in replayed)
+        STREAM_EVENTS_SENT.inc(amount=len(replayed))
+        await send(
+            {"type": "http.response.body", "body": b"".join(body), "more_body": True}
+        )
+        # Changes committed while the missed ones were read may be in both.
+        replayed_ids = {event["id"] for event in replayed}
+
+        while True:
+            timeout = keepalive_interval()
+            if expires_at is not None:
+                timeout = min(timeout, expires_at - time.time())
+                if timeout <= 0:
+                    break
+            if getter is None:
+                getter = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnect},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnect in done:
+                return
+            if getter in done:
+                event, getter = getter.result(), None
+                if event is None:
+                    break
+                if event["id"] in replayed_ids:
+                    continue
+                chunk = format_event(event)
+                STREAM_EVENTS_SENT.inc()
+            else:
+                chunk = b": keepalive\n\n"
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        for task in (getter, disconnect):
+            if task is not None:
+                task.cancel()
+        broker.unsubscribe(subscription)
+
+
+def with_contract_streams(application):
+    """
+    Wrap an ASGI application to serve the contract event streams itself,
+    outside of Django's request handling, which does not notice when the
+    client of a streaming response goes away.
+    """
+
+    async def app(scope, receive, send):
+        if scope["type"] == "http":
+            match = STREAM_PATH.match(scope["path"])
+            if match:
+                await stream_contract_events(
+                    scope, receive, send, int(match["user_id"])
+                )
+                return
+        await application(scope, receive, send)
+
+    return app
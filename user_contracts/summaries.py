@@ -0,0 +1,128 @@
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from user_contracts.models import ArchivedContract, Contract, UserContractSummary
+
+
+def apply_contract_delta(user_id, count=0, amount=Decimal("0"), fidelity=0):
+    """
+    Add the given deltas to the summary row of a user.
+
+    This must run inside the same transaction as the contract change it
+    describes, after the change was written, so the summary never drifts
+    from the contracts table. When the user has no summary row yet it is
+    computed from the contracts table instead.
+    """
+    summary = UserContractSummary.objects.filter(pk=user_id)
+    delta = {
+        "contract_count": F("contract_count") + count,
+        "total_amount": F("total_amount") + amount,
+        "total_fidelity": F("total_fidelity") + fidelity,
+    }
+    if summary.update(**delta):
+        return
+    # Concurrent first contracts of the user wait on the lock of the user
+    # row, so only the first one creates the summary and the others find it.
+    # FOR NO KEY UPDATE does not wait on the key share locks the inserts of
+    # their contracts hold, which would deadlock.
+    User.objects.select_for_update(no_key=True).filter(pk=user_id).exists()
+    if not summary.update(**delta):
+        rebuild_summaries(user_ids=[user_id])
+
+
+def contract_created(contract):
+    """Account for a newly created contract in its user's summary."""
+    apply_contract_delta(
+        contract.user_id,
+        count=1,
+        amount=Decimal(contract.amount),
+        fidelity=contract.fidelity,
+    )
+
+
+def contract_updated(contract, old_amount, old_fidelity):
+    """Account for a change of amount and/or fidelity of a contract."""
+    amount_delta = Decimal(contract.amount) - Decimal(old_amount)
+    fidelity_delta = contract.fidelity - old_fidelity
+    if amount_delta or fidelity_delta:
+        apply_contract_delta(
+            contract.user_id, amount=amount_delta, fidelity=fidelity_delta
+        )
+
+
+def contract_deleted(contract):
+    """Remove a deleted contract from its user's summary."""
+    apply_contract_delta(
+        contract.user_id,
+        count=-1,
+        amount=-Decimal(contract.amount),
+        fidelity=-contract.fidelity,
+    )
+
+
+def rebuild_summaries(user_ids=None, batch_size=1000):
+    """
+    Recompute summaries from the contracts and archived contracts tables.
+
+    When `user_ids` is given only those users are rebuilt, otherwise every
+    summary is. This is used by bulk write paths and to repair drift.
+    Returns the number of summary rows written.
+    """
+    summaries = UserContractSummary.objects.all()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        summaries = summaries.filter(user_id__in=user_ids)
+
+    with transaction.atomic():
+        summaries.delete()
+        written = 0
+        batch = []
+        for row in _contract_totals(user_ids):
+            batch.append(UserContractSummary(**row))
+            if len(batch) >= batch_size:
+                UserContractSummary.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            UserContractSummary.objects.bulk_create(batch)
+            written += len(batch)
+    return written
+
+
+def _totals(model, user_ids):
+    contracts = model.objects.all()
+    if user_ids is not None:
+        contracts = contracts.filter(user_id__in=user_ids)
+    return (
+        contracts.order_by()
+        .values("user_id")
+        .annotate(
+            contract_count=Count("id"),
+            total_amount=Sum("amount"),
+            total_fidelity=Sum("fidelity"),
+        )
+    )
+
+
+def _contract_totals(user_ids):
+    """
+    Yield the totals of every user from the contracts table, the totals of
+    their archived contracts added.
+    """
+    archived = {row["user_id"]: row for row in _totals(ArchivedContract, user_ids)}
+    for row in _totals(Contract, user_ids).iterator():
+        extra = archived.pop(row["user_id"], None)
+        if extra is not None:
+            for field in ("contract_count", "total_amount", "total_fidelity"):
+                row[field] += extra[field]
+        yield row
+    yield from archived.values()
+
+
+def get_summary(user):
+    """Return the summary of a user or None when they have no contracts."""
+    try:
+        return user.contract_summary
+    except UserContractSummary.DoesNotExist:
+        return None
@@ -1,19 +1,66 @@
+import asyncio
+import difflib
 import graphene
+import gzip
 import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from django.conf import settings
 from django.contrib.auth.models import User
-from user_contracts.models import Contract
+from asgiref.sync import async_to_sync, sync_to_async
+from power2go_project import asgi
+from user_contracts import (
+    admission,
+    changes,
+    entity_cache,
+    outbox,
+    streams,
+    versions,
+    warmup,
+)
+from user_contracts.models import (
+    Contract,
+    OutboxEvent,
+    UserContractSummary,
+)
+from user_contracts.archive import archive_contracts
+from user_contracts.metrics import mark_process_dead
+from user_contracts.offboarding import run_unfinished
+from user_contracts.summaries import rebuild_summaries
+from user_contracts.seeding import seed
+from user_contracts.documents import compile_document
+from user_contracts.benchmark import InProcessTransport, run_benchmark
+from user_contracts.api.operations import OPERATIONS
 from user_contracts.api.queries import Query
 from user_contracts.api.mutations import Mutation
 from user_contracts.api.schema import schema
 from django.core.exceptions import ObjectDoesNotExist
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from graphene_django.utils.testing import graphql_query
+from graphql_jwt.shortcuts import get_token
 
 
 # Create your tests here.
+# The tests send many requests as the same client: the rate limit is only
+# enabled by the tests of the admission control.
+@override_settings(GRAPHQL_RATE_LIMIT_RATE=0)
 class GraphqlTestCase(TestCase):
     def setUp(self):
+        # Primary keys are reused once the transaction of a test is rolled
+        # back, the entity caches must not outlive it.
+        entity_cache.clear()
+
         # Create users
         self.user1 = User.objects.create_user(
             username="user1", email="user1@example.com", password="password123"
@@ -386,3 +433,1417 @@ class GraphqlTestCase(TestCase):
         self.assertEqual(
             content["deleteContract"]["message"], "Contract deleted successfully."
         )
+        # The user had no summary yet, it is built without the contract.
+        self.assertFalse(
+            UserContractSummary.objects.filter(
+                pk=self.user1.pk, contract_count__gt=0
+            ).exists()
+        )
+        self.assertEqual(
+            OutboxEvent.objects.get(event_type=outbox.CONTRACT_DELETED).payload["id"],
+            self.contract1.id,
+        )
+
+    def test_user_contract_summary(self):
+        rebuild_summaries()
+        create = f"""
+            mutation {{
+                createContract(input: {{
+                    description: "Contract 3",
+                    userId: {self.user1.id},
+                    fidelity: 24,
+                    amount: "50.00"
+                }}) {{
+                    contract {{
+                    id
+                    }}
+                }}
+            }}
+        """
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": create}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        contract_id = json.loads(response.content)["data"]["createContract"][
+            "contract"
+        ]["id"]
+        update = f"""
+            mutation {{
+                updateContract(id: {contract_id}, input: {{amount: "60.00"}}) {{
+                    success
+                }}
+            }}
+        """
+        self.client.post(
+            "/graphql/",
+            json.dumps({"query": update}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        delete = f"""
+            mutation {{
+                deleteContract(id: {self.contract1.id}) {{
+                    success
+                }}
+            }}
+        """
+        self.client.post(
+            "/graphql/",
+            json.dumps({"query": delete}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+
+        query = f"""
+            query {{
+                getUser(id: {self.user1.id}) {{
+                    contractCount
+                    totalAmount
+                    averageFidelity
+                }}
+            }}
+        """
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        content = json.loads(response.content)["data"]["getUser"]
+        self.assertEqual(content["contractCount"], 1)
+        self.assertEqual(Decimal(content["totalAmount"]), Decimal("60.00"))
+        self.assertEqual(content["averageFidelity"], 24)
+
+        # A rebuild from the contracts table must agree with the live summary.
+        summary = UserContractSummary.objects.get(pk=self.user1.id)
+        rebuild_summaries(user_ids=[self.user1.id])
+        rebuilt = UserContractSummary.objects.get(pk=self.user1.id)
+        self.assertEqual(rebuilt.contract_count, summary.contract_count)
+        self.assertEqual(rebuilt.total_amount, summary.total_amount)
+        self.assertEqual(rebuilt.total_fidelity, summary.total_fidelity)
+
+    def test_search_contracts(self):
+        Contract.objects.create(
+            description="Solar panel maintenance",
+            user=self.user3,
+            fidelity=6,
+            amount=10,
+        )
+        Contract.objects.create(
+            description="Solar battery storage", user=self.user3, fidelity=6, amount=20
+        )
+        query = """
+            query ($after: String) {
+                searchContracts(text: "sola", first: 1, after: $after) {
+                    edges {
+                        cursor
+                        rank
+                        node {
+                            description
+                        }
+                    }
+                    endCursor
+                    hasNextPage
+                }
+            }
+        """
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        first_page = json.loads(response.content)["data"]["searchContracts"]
+        self.assertEqual(len(first_page["edges"]), 1)
+        self.assertTrue(first_page["hasNextPage"])
+
+        response = self.client.post(
+            "/graphql/",
+            json.dumps(
+                {"query": query, "variables": {"after": first_page["endCursor"]}}
+            ),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        second_page = json.loads(response.content)["data"]["searchContracts"]
+        self.assertFalse(second_page["hasNextPage"])
+        descriptions = {
+            edge["node"]["description"]
+            for edge in first_page["edges"] + second_page["edges"]
+        }
+        self.assertEqual(
+            descriptions, {"Solar panel maintenance", "Solar battery storage"}
+        )
+
+    def test_metrics_of_all_processes(self):
+        shed = admission.REQUESTS_SHED.value((admission.OVERLOADED,))
+        warmup.WORKER_STARTUP_SECONDS.set(value=1)
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory):
+                # The file of another worker process.
+                with open(os.path.join(directory, "1.json"), "w") as file:
+                    json.dump(
+                        {
+                            "graphql_requests_shed": [[["concurrency"], 3]],
+                            "worker_startup_seconds": [[[], 5]],
+                        },
+                        file,
+                    )
+                metrics = self.client.get("/metrics").content.decode()
+                self.assertIn(
+                    f'graphql_requests_shed_total{{reason="concurrency"}} {shed + 3}',
+                    metrics,
+                )
+                self.assertIn('worker_startup_seconds{pid="1"} 5', metrics)
+                self.assertIn(
+                    f'worker_startup_seconds{{pid="{os.getpid()}"}} 1', metrics
+                )
+
+                # Exited workers still count in the totals, not their gauges,
+                # and their files are folded into one.
+                with open(os.path.join(directory, "2.json"), "w") as file:
+                    json.dump({"graphql_requests_shed": [[["concurrency"], 2]]}, file)
+                mark_process_dead(1)
+                mark_process_dead(2)
+                self.assertEqual(
+                    set(os.listdir(directory)), {"dead.json", f"{os.getpid()}.json"}
+                )
+                metrics = self.client.get("/metrics").content.decode()
+                self.assertIn(
+                    f'graphql_requests_shed_total{{reason="concurrency"}} {shed + 5}',
+                    metrics,
+                )
+                self.assertNotIn('worker_startup_seconds{pid="1"}', metrics)
+                self.assertNotIn('pid="dead"', metrics)
+        warmup.WORKER_STARTUP_SECONDS.clear()
+
+    @override_settings(GRAPHQL_FIELD_TIMING_SAMPLE_RATE=1.0)
+    def test_metrics_endpoint(self):
+        query = """
+            query ListUsersForMetrics {
+                allUsers {
+                    id
+                }
+            }
+        """
+        self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn(
+            'graphql_operation_duration_seconds_count{operation="ListUsersForMetrics"}',
+            metrics,
+        )
+        self.assertIn(
+            'graphql_operation_sql_queries_count{operation="ListUsersForMetrics"}',
+            metrics,
+        )
+        self.assertIn(
+            'graphql_field_duration_seconds_count{operation="ListUsersForMetrics",'
+            'field="Query.allUsers"}',
+            metrics,
+        )
+
+    @override_settings(
+        GRAPHQL_SLOW_OPERATION_MS=0,
+        GRAPHQL_SLOW_LOG_SAMPLE_RATE=0,
+        GRAPHQL_FIELD_TIMING_SAMPLE_RATE=0,
+    )
+    def test_slow_operation_log(self):
+        query = """
+            query ContractsOfUser($id: Int!) {
+                getContractsByUserId(id: $id) {
+                    id
+                    description
+                }
+            }
+        """
+        with self.assertLogs("user_contracts.slow_operations") as logs:
+            self.client.post(
+                "/graphql/",
+                json.dumps({"query": query, "variables": {"id": self.user1.id}}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {self.token}",
+            )
+        entry = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(entry["reason"], "slow")
+        self.assertEqual(entry["operation_name"], "ContractsOfUser")
+        self.assertEqual(entry["variables"], {"id": "Int"})
+        self.assertGreaterEqual(entry["sql_queries"], 1)
+        self.assertEqual(len(entry["sql"]), entry["sql_queries"])
+        self.assertIn("user_contracts_contract", entry["sql"][-1]["sql"])
+        # Resolvers are timed even when the operation was not sampled.
+        self.assertEqual(entry["resolvers"]["Query.getContractsByUserId"]["calls"], 1)
+
+    @override_settings(GRAPHQL_SLOW_OPERATION_MS=60000, GRAPHQL_SLOW_LOG_SAMPLE_RATE=0)
+    def test_fast_operation_is_not_logged(self):
+        with self.assertNoLogs("user_contracts.slow_operations"):
+            self.client.post(
+                "/graphql/",
+                json.dumps({"query": "query { allUsers { id } }"}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {self.token}",
+            )
+
+    def test_seed_and_benchmark(self):
+        user_ids = seed(users=5, contracts=40, batch_size=7)
+        self.assertEqual(len(user_ids), 5)
+        self.assertEqual(Contract.objects.filter(user_id__in=user_ids).count(), 40)
+        self.assertEqual(
+            sum(
+                UserContractSummary.objects.filter(user_id__in=user_ids).values_list(
+                    "contract_count", flat=True
+                )
+            ),
+            40,
+        )
+
+        report = run_benchmark(
+            InProcessTransport(),
+            list(OPERATIONS.values()),
+            requests=3,
+            concurrency=1,
+            warmup=1,
+        )
+        for name, result in report["operations"].items():
+            self.assertEqual(result["errors"], 0, name)
+            self.assertEqual(result["requests"], 3)
+            self.assertIsNotNone(result["latency_ms"]["p99"])
+            self.assertIsNotNone(result["sql_queries"])
+            # Point lookups may all be answered by the entity cache.
+            if name not in ("GetUser", "GetContract"):
+                self.assertGreaterEqual(result["sql_queries"]["max"], 1)
+
+    @override_settings(GRAPHQL_RATE_LIMIT_RATE=0.001, GRAPHQL_RATE_LIMIT_BURST=40)
+    def test_benchmark_without_admission(self):
+        operations = [OPERATIONS["AllContracts"]]
+        admission.BACKENDS["local"].clear()
+        report = run_benchmark(
+            InProcessTransport(), operations, requests=5, concurrency=1, warmup=0
+        )
+        result = report["operations"]["AllContracts"]
+        self.assertEqual(result["errors"], 0)
+
+        # Rejected requests are reported as errors, and not timed.
+        admission.BACKENDS["local"].clear()
+        report = run_benchmark(
+            InProcessTransport(admission=True),
+            operations,
+            requests=5,
+            concurrency=1,
+            warmup=0,
+        )
+        result = report["operations"]["AllContracts"]
+        self.assertEqual(result["errors"], 4)
+        self.assertEqual(result["error_statuses"], {"429": 4})
+        self.assertIsNotNone(result["latency_ms"]["p50"])
+
+    @override_settings(GRAPHQL_COMPRESSION_MIN_BYTES=0)
+    def test_compressed_response(self):
+        query = """
+            query {
+                allContracts {
+                    id
+                    amount
+                    createdAt
+                }
+            }
+        """
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            HTTP_ACCEPT_ENCODING="gzip;q=1.0, identity;q=0.5",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        body = gzip.decompress(b"".join(response.streaming_content))
+        content = json.loads(body)["data"]
+        self.assertEqual(len(content["allContracts"]), 2)
+        self.assertEqual(
+            Decimal(content["allContracts"][0]["amount"]), self.contract1.amount
+        )
+
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(len(json.loads(response.content)["data"]["allContracts"]), 2)
+
+    def test_get_query_etag(self):
+        params = {"query": "query { allContracts { id description } }"}
+        response = self.client.get("/graphql/", params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("max-age", response["Cache-Control"])
+
+        response = self.client.get(
+            "/graphql/",
+            params,
+            HTTP_ACCEPT="application/json",
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertIn("public", response["Cache-Control"])
+
+        # Responses computed with credentials stay out of shared caches.
+        response = self.client.get(
+            "/graphql/",
+            params,
+            HTTP_ACCEPT="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        self.assertIn("private", response["Cache-Control"])
+        self.assertNotIn("public", response["Cache-Control"])
+
+        mutation = f"""
+            mutation {{
+                updateContract(id: {self.contract1.id}, input: {{
+                    description: "Renamed contract"
+                }}) {{
+                    success
+                }}
+            }}
+        """
+        self.client.post(
+            "/graphql/",
+            json.dumps({"query": mutation}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        response = self.client.get(
+            "/graphql/",
+            params,
+            HTTP_ACCEPT="application/json",
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(
+            json.loads(response.content)["data"]["allContracts"][0]["description"],
+            "Renamed contract",
+        )
+
+        response = self.client.get(
+            "/graphql/",
+            {"query": "mutation { deleteContract(id: 1) { success } }"},
+            HTTP_ACCEPT="application/json",
+            HTTP_IF_NONE_MATCH="*",
+        )
+        self.assertEqual(response.status_code, 405)
+
+    def test_version_totals(self):
+        before = versions.current_versions()
+        for user_id in range(1, 41):
+            versions.bump(user_id, versions.CONTRACTS)
+        versions.bump(None, versions.CONTRACTS, versions.USERS)
+        # Totals read the shard stamps, whatever the number of users.
+        with self.assertNumQueries(1):
+            after = versions.current_versions()
+        self.assertEqual(after[versions.CONTRACTS], before[versions.CONTRACTS] + 41)
+        self.assertEqual(after[versions.USERS], before[versions.USERS] + 1)
+        self.assertEqual(
+            versions.current_versions(1)[versions.CONTRACTS],
+            versions.current_versions(2)[versions.CONTRACTS],
+        )
+
+    def test_get_query_etag_per_user(self):
+        def etag(query, variables=None):
+            params = {"query": query}
+            if variables is not None:
+                params["variables"] = json.dumps(variables)
+            response = self.client.get(
+                "/graphql/", params, HTTP_ACCEPT="application/json"
+            )
+            self.assertEqual(response.status_code, 200)
+            return response["ETag"]
+
+        by_user = "query($id: Int!) { getContractsByUserId(id: $id) { id } }"
+        all_contracts = "query { allContracts { id } }"
+        before = (
+            etag(by_user, {"id": self.user1.id}),
+            etag(by_user, {"id": self.user2.id}),
+            etag(all_contracts),
+        )
+
+        mutation = f"""
+            mutation {{
+                updateContract(id: {self.contract2.id}, input: {{
+                    description: "Renamed contract"
+                }}) {{
+                    success
+                }}
+            }}
+        """
+        self.client.post(
+            "/graphql/",
+            json.dumps({"query": mutation}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        # Only the operations reading the contracts of user2 see the write.
+        self.assertEqual(etag(by_user, {"id": self.user1.id}), before[0])
+        self.assertNotEqual(etag(by_user, {"id": self.user2.id}), before[1])
+        self.assertNotEqual(etag(all_contracts), before[2])
+
+        # Bulk writes concern every user.
+        changes.bulk_changed()
+        self.assertNotEqual(etag(by_user, {"id": self.user1.id}), before[0])
+
+    def test_batched_operations(self):
+        get_user = f"""
+            query {{
+                getUser(id: {self.user1.id}) {{
+                    username
+                    contractCount
+                }}
+            }}
+        """
+        get_contract = f"""
+            query {{
+                getContract(id: {self.contract1.id}) {{
+                    description
+                    user {{
+                        username
+                    }}
+                }}
+            }}
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/graphql/",
+                json.dumps(
+                    [
+                        {"id": 1, "query": get_user},
+                        {"id": 2, "query": get_contract},
+                        {"id": 3, "query": get_user},
+                    ]
+                ),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {self.token}",
+            )
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertEqual([result["id"] for result in content], [1, 2, 3])
+        self.assertEqual(content[0]["data"]["getUser"]["username"], "user1")
+        self.assertEqual(content[1]["data"]["getContract"]["user"]["username"], "user1")
+        self.assertEqual(content[2]["data"], content[0]["data"])
+        # One query verifies the token and one loads the user, both shared
+        # by the three operations.
+        user_queries = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('SELECT "auth_user"')
+        ]
+        self.assertEqual(len(user_queries), 2)
+
+    def test_invalid_batch(self):
+        response = self.client.post("/graphql/", "[]", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/graphql/", "[1]", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_revenue_projection(self):
+        cache.clear()
+        Contract.objects.filter(pk=self.contract1.pk).update(
+            created_at=datetime(2025, 1, 15, tzinfo=timezone.utc),
+            amount=120,
+            fidelity=12,
+        )
+        Contract.objects.filter(pk=self.contract2.pk).update(
+            created_at=datetime(2025, 6, 1, tzinfo=timezone.utc),
+            amount=240,
+            fidelity=24,
+        )
+        query = """
+            query ($groupBy: RevenueGroupBy) {
+                revenueProjection(from: "2025-01-01", to: "2025-12-31", groupBy: $groupBy) {
+                    key
+                    month
+                    amount
+                }
+            }
+        """
+
+        def projection(group_by):
+            response = self.client.post(
+                "/graphql/",
+                json.dumps({"query": query, "variables": {"groupBy": group_by}}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {self.token}",
+            )
+            return {
+                bucket["key"]: Decimal(bucket["amount"])
+                for bucket in json.loads(response.content)["data"]["revenueProjection"]
+            }
+
+        by_month = projection("MONTH")
+        self.assertEqual(len(by_month), 12)
+        self.assertEqual(by_month["2025-01"], Decimal("10.00"))
+        self.assertEqual(by_month["2025-05"], Decimal("10.00"))
+        self.assertEqual(by_month["2025-06"], Decimal("20.00"))
+        self.assertEqual(by_month["2025-12"], Decimal("20.00"))
+        self.assertEqual(
+            projection("USER"),
+            {
+                str(self.user1.id): Decimal("120.00"),
+                str(self.user2.id): Decimal("70.00"),
+            },
+        )
+        self.assertEqual(
+            projection("TIER"), {"12": Decimal("120.00"), "24": Decimal("70.00")}
+        )
+
+    def test_contract_admin_changelist(self):
+        admin_user = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password123"
+        )
+        self.client.force_login(admin_user)
+
+        def changelist_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/admin/user_contracts/contract/")
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        before = changelist_queries()
+        for index in range(20):
+            Contract.objects.create(
+                description=f"Extra {index}", user=self.user3, fidelity=6, amount=1
+            )
+        self.assertEqual(changelist_queries(), before)
+
+        response = self.client.get(
+            "/admin/user_contracts/contract/", {"q": "Contract 1"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Contract 1")
+        self.assertNotContains(response, "Contract 2")
+
+    def test_contract_admin_changes(self):
+        admin_user = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password123"
+        )
+        self.client.force_login(admin_user)
+        rebuild_summaries()
+
+        def summary(user):
+            return UserContractSummary.objects.filter(user=user).first()
+
+        def events():
+            return list(
+                OutboxEvent.objects.order_by("id").values_list("event_type", "user_id")
+            )
+
+        response = self.client.post(
+            "/admin/user_contracts/contract/add/",
+            {
+                "description": "Admin contract",
+                "user": self.user1.id,
+                "fidelity": 6,
+                "amount": "10.00",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        contract = Contract.objects.get(description="Admin contract")
+        self.assertEqual(summary(self.user1).contract_count, 2)
+        self.assertEqual(events()[-1], (outbox.CONTRACT_CREATED, self.user1.id))
+
+        # Moving it to another user moves it between their summaries.
+        response = self.client.post(
+            f"/admin/user_contracts/contract/{contract.id}/change/",
+            {
+                "description": "Admin contract",
+                "user": self.user2.id,
+                "fidelity": 6,
+                "amount": "15.00",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(summary(self.user1).contract_count, 1)
+        self.assertEqual(summary(self.user2).contract_count, 2)
+        self.assertEqual(summary(self.user2).total_amount, Decimal("215.75"))
+
+        response = self.client.post(
+            "/admin/user_contracts/contract/",
+            {
+                "action": "delete_selected",
+                "_selected_action": [contract.id, self.contract1.id],
+                "post": "yes",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(
+            Contract.objects.filter(pk__in=[contract.id, self.contract1.id]).exists()
+        )
+        self.assertEqual(summary(self.user1).contract_count, 0)
+        self.assertEqual(summary(self.user2).contract_count, 1)
+        self.assertEqual(
+            sorted(events()[-2:]),
+            sorted(
+                [
+                    (outbox.CONTRACT_DELETED, self.user1.id),
+                    (outbox.CONTRACT_DELETED, self.user2.id),
+                ]
+            ),
+        )
+
+    def test_offboard_user(self):
+        for index in range(6):
+            Contract.objects.create(
+                description=f"Extra {index}", user=self.user2, fidelity=6, amount=1
+            )
+        rebuild_summaries()
+
+        def post(query):
+            response = self.client.post(
+                "/graphql/",
+                json.dumps({"query": query}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {self.token}",
+            )
+            return json.loads(response.content)
+
+        content = post(
+            f"""
+                mutation {{
+                    offboardUser(id: {self.user2.id}) {{
+                        success
+                        offboarding {{ status contractsTotal contractsDeleted }}
+                    }}
+                }}
+            """
+        )["data"]["offboardUser"]
+        self.assertTrue(content["success"])
+        self.assertEqual(
+            content["offboarding"],
+            {"status": "PENDING", "contractsTotal": 7, "contractsDeleted": 0},
+        )
+        self.user2.refresh_from_db()
+        self.assertFalse(self.user2.is_active)
+
+        # Contracts are refused to users being offboarded only, not to the
+        # users deactivated otherwise.
+        self.user3.is_active = False
+        self.user3.save()
+        create = """
+            mutation {{
+                createContract(input: {{
+                    description: "Late contract",
+                    userId: {},
+                    fidelity: 6,
+                    amount: 10
+                }}) {{ contract {{ id }} }}
+            }}
+        """
+        content = post(create.format(self.user2.id))
+        self.assertIn(
+            "You cannot create a contract for a user being offboarded.",
+            content["errors"][0]["message"],
+        )
+        content = post(create.format(self.user3.id))
+        self.assertNotIn("errors", content)
+
+        progress = []
+        ran = run_unfinished(
+            size=3,
+            progress=lambda offboarding: progress.append(offboarding.contracts_deleted),
+        )
+        self.assertEqual(ran, 1)
+        self.assertEqual(progress, [3, 6, 7, 7])
+        self.assertFalse(Contract.objects.filter(user_id=self.user2.id).exists())
+        self.assertFalse(User.objects.filter(pk=self.user2.id).exists())
+        self.assertFalse(UserContractSummary.objects.filter(pk=self.user2.id).exists())
+        self.assertTrue(Contract.objects.filter(pk=self.contract1.pk).exists())
+
+        content = post(
+            f"query {{ getOffboarding(userId: {self.user2.id}) {{ status }} }}"
+        )
+        self.assertEqual(content["data"]["getOffboarding"]["status"], "DONE")
+
+    def test_outbox_delivery(self):
+        received, statuses = [], [500]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                received.append((self.headers["Content-Encoding"], body))
+                self.send_response(statuses.pop(0) if statuses else 200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        def post(query):
+            self.client.post(
+                "/graphql/",
+                json.dumps({"query": query}),
+                content_type="application/json",
+            )
+
+        post(
+            f"""
+                mutation {{
+                    createContract(input: {{
+                        description: "Outbox contract",
+                        userId: {self.user3.id},
+                        fidelity: 6,
+                        amount: 10
+                    }}) {{ contract {{ id }} }}
+                }}
+            """
+        )
+        contract = Contract.objects.get(description="Outbox contract")
+        post(
+            f"""
+                mutation {{
+                    updateContract(id: {contract.id}, input: {{ amount: 20 }}) {{
+                        success
+                    }}
+                }}
+            """
+        )
+        post(f"mutation {{ deleteContract(id: {contract.id}) {{ success }} }}")
+        self.assertEqual(OutboxEvent.objects.filter(user_id=self.user3.id).count(), 3)
+
+        url = f"http://127.0.0.1:{server.server_port}/events"
+        with override_settings(OUTBOX_ENDPOINT_URL=url, OUTBOX_RETRY_BASE_DELAY=0):
+            # The first attempt is refused, the events are retried in order.
+            with self.assertLogs("user_contracts.outbox", "WARNING"):
+                self.assertEqual(outbox.deliver_pending(size=2), 0)
+            self.assertEqual(OutboxEvent.objects.filter(attempts=1).count(), 2)
+            self.assertEqual(outbox.deliver_pending(size=2), 3)
+
+        self.assertEqual(len(received), 3)
+        self.assertTrue(all(coding == "gzip" for coding, _ in received))
+        events = [
+            event
+            for _, body in received[1:]
+            for event in json.loads(gzip.decompress(body))["events"]
+        ]
+        self.assertEqual(
+            [event["type"] for event in events],
+            ["contract.created", "contract.updated", "contract.deleted"],
+        )
+        self.assertEqual(events[1]["payload"]["amount"], "20.00")
+        self.assertFalse(OutboxEvent.objects.filter(delivered_at__isnull=True).exists())
+
+    def test_contract_archive(self):
+        cache.clear()
+        rebuild_summaries()
+        old = datetime(2020, 3, 1, tzinfo=timezone.utc)
+        Contract.objects.filter(pk=self.contract1.pk).update(created_at=old)
+
+        moved = archive_contracts(datetime(2021, 1, 1, tzinfo=timezone.utc), size=1)
+        self.assertEqual(moved, 1)
+        self.assertFalse(Contract.objects.filter(pk=self.contract1.pk).exists())
+        self.assertEqual(self.user1.contract_summary.contract_count, 1)
+
+        def contracts(arguments=""):
+            query = f"query {{ allContracts{arguments} {{ id archived }} }}"
+            response = self.client.post(
+                "/graphql/",
+                json.dumps({"query": query}),
+                content_type="application/json",
+            )
+            return [
+                (int(contract["id"]), contract["archived"])
+                for contract in json.loads(response.content)["data"]["allContracts"]
+            ]
+
+        self.assertEqual(contracts(), [(self.contract2.pk, False)])
+        self.assertEqual(
+            contracts('(createdAfter: "2021-06-01T00:00:00+00:00")'),
+            [(self.contract2.pk, False)],
+        )
+        self.assertEqual(
+            contracts('(createdAfter: "2020-01-01T00:00:00+00:00")'),
+            [(self.contract1.pk, True), (self.contract2.pk, False)],
+        )
+        self.assertEqual(
+            contracts('(createdBefore: "2021-01-01T00:00:00+00:00")'),
+            [(self.contract1.pk, True)],
+        )
+
+        query = f"query {{ getContract(id: {self.contract1.pk}) {{ archived user {{ username }} }} }}"
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+        )
+        self.assertEqual(
+            json.loads(response.content)["data"]["getContract"],
+            {"archived": True, "user": {"username": "user1"}},
+        )
+
+    def test_entity_cache_tiers(self):
+        def lookup():
+            entity_cache.contracts._local.clear()
+            stats = entity_cache.contracts.stats()
+            self.assertIsNotNone(entity_cache.contracts.get(self.contract1.id))
+            new_stats = entity_cache.contracts.stats()
+            return {key: new_stats[key] - stats[key] for key in stats}
+
+        # A cache in the memory of the process is not shared: only the LRU
+        # is used, so the invalidations of other processes are not missed.
+        entity_cache.clear()
+        self.assertFalse(entity_cache.cache_is_shared())
+        entity_cache.contracts.get(self.contract1.id)
+        self.assertEqual(lookup(), {"local_hit": 0, "shared_hit": 0, "miss": 1})
+
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {
+                "default": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": directory,
+                }
+            }
+            with override_settings(CACHES=shared):
+                entity_cache.clear()
+                self.assertTrue(entity_cache.cache_is_shared())
+                entity_cache.contracts.get(self.contract1.id)
+                self.assertEqual(lookup(), {"local_hit": 0, "shared_hit": 1, "miss": 0})
+                entity_cache.clear()
+
+    def test_entity_cache(self):
+        def get_contract():
+            query = f"""
+                query {{
+                    getContract(id: {self.contract1.id}) {{
+                        description
+                        user {{ username contractCount }}
+                    }}
+                }}
+            """
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    "/graphql/",
+                    json.dumps({"query": query}),
+                    content_type="application/json",
+                )
+            return json.loads(response.content)["data"]["getContract"], len(queries)
+
+        rebuild_summaries()
+        stats = entity_cache.contracts.stats()
+        contract, queries = get_contract()
+        self.assertEqual(queries, 1)
+        self.assertEqual(contract["user"]["contractCount"], 1)
+        contract, queries = get_contract()
+        self.assertEqual(queries, 0)
+        self.assertEqual(contract["user"]["username"], "user1")
+        new_stats = entity_cache.contracts.stats()
+        self.assertEqual(new_stats["miss"], stats["miss"] + 1)
+        self.assertEqual(new_stats["local_hit"], stats["local_hit"] + 1)
+
+        # The mutations invalidate the contract and its user.
+        self.client.post(
+            "/graphql/",
+            json.dumps(
+                {
+                    "query": f"""
+                        mutation {{
+                            createContract(input: {{
+                                description: "Another contract",
+                                userId: {self.user1.id},
+                                fidelity: 6,
+                                amount: 10
+                            }}) {{ success }}
+                        }}
+                    """
+                }
+            ),
+            content_type="application/json",
+        )
+        self.client.post(
+            "/graphql/",
+            json.dumps(
+                {
+                    "query": f"""
+                        mutation {{
+                            updateContract(id: {self.contract1.id}, input: {{
+                                description: "Renamed contract"
+                            }}) {{ success }}
+                        }}
+                    """
+                }
+            ),
+            content_type="application/json",
+        )
+        contract, queries = get_contract()
+        self.assertEqual(contract["description"], "Renamed contract")
+        self.assertEqual(contract["user"]["contractCount"], 2)
+
+    @override_settings(GRAPHQL_RATE_LIMIT_RATE=0.001, GRAPHQL_RATE_LIMIT_BURST=40)
+    def test_rate_limit(self):
+        admission.BACKENDS["local"].clear()
+        shed = admission.REQUESTS_SHED.value((admission.RATE_LIMITED,))
+        query = "query { allContracts { id description } }"
+        self.assertEqual(admission.operation_cost(query), 21)
+
+        def post(**headers):
+            return self.client.post(
+                "/graphql/",
+                json.dumps({"query": query}),
+                content_type="application/json",
+                **headers,
+            )
+
+        self.assertEqual(
+            post(HTTP_AUTHORIZATION=f"Bearer {self.token}").status_code, 200
+        )
+        response = post(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 1)
+        self.assertEqual(
+            admission.REQUESTS_SHED.value((admission.RATE_LIMITED,)), shed + 1
+        )
+        # Anonymous requests are charged to the bucket of their address.
+        self.assertEqual(post().status_code, 200)
+        self.assertEqual(post().status_code, 429)
+
+    @override_settings(GRAPHQL_MAX_CONCURRENT_REQUESTS=1)
+    def test_concurrency_limit(self):
+        shed = admission.REQUESTS_SHED.value((admission.OVERLOADED,))
+        params = {"query": "query { allContracts { id } }"}
+        with admission.concurrency_slot() as admitted:
+            self.assertTrue(admitted)
+            response = self.client.get(
+                "/graphql/", params, HTTP_ACCEPT="application/json"
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(
+            admission.REQUESTS_SHED.value((admission.OVERLOADED,)), shed + 1
+        )
+        response = self.client.get("/graphql/", params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(
+        GRAPHQL_MAX_CONCURRENT_REQUESTS=1,
+        GRAPHQL_CONCURRENCY_BACKEND="cache",
+        GRAPHQL_RATE_LIMIT_RATE=0.001,
+        GRAPHQL_RATE_LIMIT_BURST=40,
+    )
+    def test_shared_concurrency_limit(self):
+        admission.BACKENDS["local"].clear()
+        slots = admission.SLOTS["cache"]
+        params = {"query": "query { allContracts { id description } }"}
+        # A slot taken by another process, in the previous window.
+        now = time.time()
+        slot = slots.acquire(1, now - slots.window)
+        self.assertIsNotNone(slot)
+        self.assertIsNone(slots.acquire(1, now))
+        response = self.client.get("/graphql/", params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        slots.release(slot)
+
+        # The shed request did not spend the tokens of the client.
+        response = self.client.get("/graphql/", params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/graphql/", params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 1)
+
+    def test_documents_compiled_once(self):
+        warmup.compile_operations()
+        operation = OPERATIONS["AllUsers"]
+        before = compile_document.cache_info()
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": operation.document, "operationName": operation.name}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+        self.assertEqual(len(response.json()["data"]["allUsers"]), User.objects.count())
+        after = compile_document.cache_info()
+        self.assertEqual(after.hits, before.hits + 1)
+        self.assertEqual(after.misses, before.misses)
+
+        # Documents that do not parse are answered with their syntax error.
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": "query { allUsers {"}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Syntax Error", response.json()["errors"][0]["message"])
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "query_baselines.json")
+
+
+@override_settings(GRAPHQL_RATE_LIMIT_RATE=0)
+class QueryCountRegressionTestCase(TestCase):
+    """
+    Run every documented operation against seeded data of growing sizes and
+    check that its SQL query count does not grow with the number of rows,
+    and that its query count stays within the recorded baselines.
+
+    Wall-clock time depends on the machine and its load, so the median
+    latency of `LATENCY_RUNS` runs is only compared with its baseline with
+    `CHECK_QUERY_LATENCY=1`. Run with `UPDATE_QUERY_BASELINES=1` to record
+    new baselines after an intended change.
+    """
+
+    # Users and contracts added before each measurement.
+    SIZES = [(3, 10), (10, 100), (20, 400)]
+    LATENCY_RUNS = 5
+    LATENCY_TOLERANCE = float(os.environ.get("QUERY_BASELINE_LATENCY_TOLERANCE", 3))
+    # Absolute slack so that operations with tiny baselines are not flaky.
+    LATENCY_SLACK_MS = 20
+
+    def setUp(self):
+        random.seed(0)
+        entity_cache.clear()
+
+    def seed(self, users, contracts):
+        user_ids = seed(users, contracts)
+        # Make sure the search operation finds contracts at every size.
+        Contract.objects.create(
+            description="Solar maintenance", user_id=user_ids[0], fidelity=12, amount=1
+        )
+
+    def run_operation(self, operation):
+        user_id, contract_id = (
+            Contract.objects.order_by("-pk").values_list("user_id", "pk").first()
+        )
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = self.client.post(
+                "/graphql/",
+                json.dumps(
+                    {
+                        "query": operation.document,
+                        "variables": operation.variables(user_id, contract_id),
+                    }
+                ),
+                content_type="application/json",
+            )
+            duration = time.perf_counter() - start
+        content = json.loads(response.content)
+        self.assertNotIn("errors", content, operation.name)
+        return [query["sql"] for query in queries.captured_queries], duration
+
+    @staticmethod
+    def normalize(sql):
+        sql = re.sub(r"'[^']*'", "?", sql)
+        return re.sub(r"\b\d+(\.\d+)?\b", "?", sql)
+
+    def assertSameQueries(self, name, smaller, larger):
+        if len(smaller) == len(larger):
+            return
+        diff = "\n".join(
+            difflib.unified_diff(
+                [self.normalize(sql) for sql in smaller],
+                [self.normalize(sql) for sql in larger],
+                "fewer rows",
+                "more rows",
+                lineterm="",
+            )
+        )
+        self.fail(
+            f"{name} issued {len(smaller)} queries with fewer rows and "
+            f"{len(larger)} with more rows, a resolver queries per row:\n{diff}"
+        )
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        measurements = {name: [] for name in OPERATIONS}
+        for users, contracts in self.SIZES:
+            self.seed(users, contracts)
+            for name, operation in OPERATIONS.items():
+                measurements[name].append(self.run_operation(operation))
+
+        results = {}
+        for name, runs in measurements.items():
+            for (smaller, _), (larger, _) in zip(runs, runs[1:]):
+                self.assertSameQueries(name, smaller, larger)
+            queries, duration = runs[-1]
+            durations = [duration] + [
+                self.run_operation(OPERATIONS[name])[1]
+                for _ in range(self.LATENCY_RUNS - 1)
+            ]
+            results[name] = {
+                "sql_queries": len(queries),
+                "median_ms": round(statistics.median(durations) * 1000, 1),
+            }
+
+        if os.environ.get("UPDATE_QUERY_BASELINES"):
+            with open(BASELINES_PATH, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+            return
+
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+        for name, result in results.items():
+            self.assertIn(name, baselines, f"No baseline recorded for {name}.")
+            baseline = baselines[name]
+            self.assertLessEqual(
+                result["sql_queries"],
+                baseline["sql_queries"],
+                f"{name} issues more SQL queries than its baseline.",
+            )
+            if os.environ.get("CHECK_QUERY_LATENCY"):
+                self.assertLessEqual(
+                    result["median_ms"],
+                    baseline["median_ms"] * self.LATENCY_TOLERANCE
+                    + self.LATENCY_SLACK_MS,
+                    f"{name} is slower than its baseline.",
+                )
+
+
+@override_settings(GRAPHQL_RATE_LIMIT_RATE=0)
+class ConcurrentBatchTestCase(TransactionTestCase):
+    def setUp(self):
+        entity_cache.clear()
+
+    @override_settings(GRAPHQL_BATCH_CONCURRENCY=3)
+    def test_concurrent_batched_queries(self):
+        users = [
+            User.objects.create_user(username=f"batch{index}", password="password123")
+            for index in range(4)
+        ]
+        query = "query ($id: Int!) { getUser(id: $id) { username } }"
+
+        def post_batch():
+            response = self.client.post(
+                "/graphql/",
+                json.dumps(
+                    [{"query": query, "variables": {"id": user.id}} for user in users]
+                ),
+                content_type="application/json",
+            )
+            return json.loads(response.content)
+
+        content = post_batch()
+        self.assertEqual(
+            [result["data"]["getUser"]["username"] for result in content],
+            [user.username for user in users],
+        )
+
+        # The next batches reuse the threads of the pool.
+        def pool_threads():
+            return {
+                thread
+                for thread in threading.enumerate()
+                if thread.name.startswith("graphql-batch")
+            }
+
+        threads = pool_threads()
+        self.assertTrue(threads)
+        post_batch()
+        self.assertLessEqual(threads, pool_threads())
+        self.assertLessEqual(len(pool_threads()), 3)
+
+
+@override_settings(GRAPHQL_RATE_LIMIT_RATE=0)
+class ContractStreamTestCase(TransactionTestCase):
+    def setUp(self):
+        entity_cache.clear()
+        self.user = User.objects.create_user(username="streamer", password="pass")
+        self.token = get_token(self.user)
+
+    def open_stream(self, headers=()):
+        """
+        Open the event stream of the user on the ASGI application and
+        return the queues of the messages sent to and by it, with its task.
+        """
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        received.put_nowait({"type": "http.request", "body": b""})
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": f"/users/{self.user.pk}/contracts/stream",
+            "query_string": b"",
+            "headers": list(headers),
+        }
+        task = asyncio.ensure_future(asgi.application(scope, received.get, sent.put))
+        return received, sent, task
+
+    def create_contract(self):
+        self.client.post(
+            "/graphql/",
+            json.dumps(
+                {
+                    "query": f"""
+                    mutation {{
+                        createContract(input: {{
+                            description: "Streamed contract",
+                            userId: {self.user.pk},
+                            fidelity: 12,
+                            amount: "30.00"
+                        }}) {{ contract {{ id }} }}
+                    }}
+                    """
+                }
+            ),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.token}",
+        )
+
+    def test_contract_changes_are_streamed(self):
+        authorization = (b"authorization", f"Bearer {self.token}".encode())
+
+        async def scenario():
+            received, sent, task = self.open_stream([authorization])
+            start = await asyncio.wait_for(sent.get(), 5)
+            await asyncio.wait_for(sent.get(), 5)  # The reconnection delay.
+            await sync_to_async(self.create_contract)()
+            live = await asyncio.wait_for(sent.get(), 5)
+            received.put_nowait({"type": "http.disconnect"})
+            await asyncio.wait_for(task, 5)
+
+            # A client reconnecting gets the events it missed.
+            received, sent, task = self.open_stream(
+                [authorization, (b"last-event-id", b"0")]
+            )
+            await asyncio.wait_for(sent.get(), 5)
+            replayed = await asyncio.wait_for(sent.get(), 5)
+            received.put_nowait({"type": "http.disconnect"})
+            await asyncio.wait_for(task, 5)
+            return start, live, replayed
+
+        start, live, replayed = async_to_sync(scenario)()
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+        event_id, name, data, _, _ = live["body"].decode().split("\n")
+        self.assertEqual(name, "event: contract.created")
+        event = json.loads(data.removeprefix("data: "))
+        self.assertEqual(event_id, f"id: {event['id']}")
+        self.assertEqual(event["user_id"], self.user.pk)
+        self.assertEqual(event["payload"]["description"], "Streamed contract")
+        self.assertEqual(event["payload"]["amount"], "30.00")
+        self.assertIn(live["body"], replayed["body"])
+        self.assertEqual(streams.broker.count(), 0)
+
+    async def read_stream(self, sent):
+        """Return the body sent by a stream until it ends."""
+        body = b""
+        while True:
+            message = await asyncio.wait_for(sent.get(), 5)
+            body += message.get("body", b"")
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                return body
+
+    def test_replay_includes_events_committed_out_of_order(self):
+        self.create_contract()
+        self.create_contract()
+        first, last = OutboxEvent.objects.order_by("id").values_list("id", flat=True)
+        # The client got the last event while the first one, written
+        # before it, was still uncommitted.
+        authorization = (b"authorization", f"Bearer {self.token}".encode())
+        headers = [authorization, (b"last-event-id", str(last).encode())]
+
+        async def scenario():
+            received, sent, task = self.open_stream(headers)
+            await asyncio.wait_for(sent.get(), 5)
+            replayed = await asyncio.wait_for(sent.get(), 5)
+            received.put_nowait({"type": "http.disconnect"})
+            await asyncio.wait_for(task, 5)
+            return replayed["body"]
+
+        replayed = async_to_sync(scenario)()
+        self.assertIn(f"id: {first}\n".encode(), replayed)
+        self.assertNotIn(f"id: {last}\n".encode(), replayed)
+
+    @override_settings(CONTRACT_STREAM_QUEUE_SIZE=2, CONTRACT_STREAM_REPLAY_LIMIT=1)
+    def test_lagging_streams_are_closed_and_reset(self):
+        authorization = (b"authorization", f"Bearer {self.token}".encode())
+        events = [
+            {"id": index, "type": "contract.created", "user_id": self.user.pk}
+            for index in range(1, 4)
+        ]
+
+        async def scenario():
+            _, sent, task = self.open_stream([authorization])
+            await asyncio.wait_for(sent.get(), 5)
+            streams.broker.deliver(events)
+            body = await self.read_stream(sent)
+            await asyncio.wait_for(task, 5)
+            return body
+
+        # The stream ends once the events queued before the overflow are sent.
+        body = async_to_sync(scenario)()
+        self.assertIn(b"id: 2\n", body)
+        self.assertNotIn(b"id: 3\n", body)
+
+        # A client that missed more events than the replay limit is reset.
+        self.create_contract()
+        self.create_contract()
+
+        async def reconnect():
+            received, sent, task = self.open_stream(
+                [authorization, (b"last-event-id", b"0")]
+            )
+            await asyncio.wait_for(sent.get(), 5)
+            replayed = await asyncio.wait_for(sent.get(), 5)
+            received.put_nowait({"type": "http.disconnect"})
+            await asyncio.wait_for(task, 5)
+            return replayed["body"]
+
+        replayed = async_to_sync(reconnect)()
+        self.assertIn(b"event: reset\n", replayed)
+        self.assertNotIn(b"event: contract.created\n", replayed)
+
+    @override_settings(CONTRACT_STREAM_KEEPALIVE=0.2)
+    def test_keepalive_until_token_expiry(self):
+        with override_settings(
+            GRAPHQL_JWT={
+                **settings.GRAPHQL_JWT,
+                "JWT_EXPIRATION_DELTA": timedelta(seconds=2),
+            }
+        ):
+            token = get_token(self.user)
+        authorization = (b"authorization", f"Bearer {token}".encode())
+
+        async def scenario():
+            _, sent, task = self.open_stream([authorization])
+            start = await asyncio.wait_for(sent.get(), 5)
+            body = await self.read_stream(sent)
+            await asyncio.wait_for(task, 5)
+            return start, body
+
+        start, body = async_to_sync(scenario)()
+        self.assertEqual(start["status"], 200)
+        self.assertIn(b": keepalive\n\n", body)
+        self.assertEqual(streams.broker.count(), 0)
+
+    def stream_status(self, headers=()):
+        async def scenario():
+            received, sent, task = self.open_stream(headers)
+            start = await asyncio.wait_for(sent.get(), 5)
+            received.put_nowait({"type": "http.disconnect"})
+            await asyncio.wait_for(task, 5)
+            return start
+
+        return async_to_sync(scenario)()["status"]
+
+    def test_stream_requires_authorization(self):
+        self.assertEqual(self.stream_status(), 401)
+        other = User.objects.create_user(username="other", password="pass")
+        token = get_token(other)
+        authorization = (b"authorization", f"Bearer {token}".encode())
+        self.assertEqual(self.stream_status([authorization]), 403)
+        other.is_staff = True
+        other.save()
+        self.assertEqual(self.stream_status([authorization]), 200)
+        other.delete()
+        self.assertEqual(self.stream_status([authorization]), 401)
@@ -1,9 +1,13 @@
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
 from user_contracts.api.schema import schema
+from user_contracts.views import ContractsGraphQLView, metrics_view
 
 urlpatterns = [
-    path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema)))
+    path(
+        "graphql/",
+        csrf_exempt(ContractsGraphQLView.as_view(graphiql=True, schema=schema)),
+    ),
+    path("metrics", metrics_view),
 ]
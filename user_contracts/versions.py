@@ -0,0 +1,81 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from user_contracts.models import DataVersion
+
+USERS = "users"
+CONTRACTS = "contracts"
+KINDS = (USERS, CONTRACTS)
+
+# Stamps of the changes that are not tied to a single user, such as bulk
+# writes, are kept under this key instead of a user id.
+ALL_USERS = "*"
+
+# The changes of every user are also counted in one of this many shared
+# stamps, picked by user id, so the version of all the data is the sum of
+# a fixed number of rows while writers for different users rarely share a
+# row.
+SHARDS = 16
+
+
+def stamp_name(name, user_id=None):
+    return f"{name}:{ALL_USERS if user_id is None else user_id}"
+
+
+def shard_name(name, shard):
+    return f"{name}:shard:{shard}"
+
+
+def _increment(stamp):
+    updated = DataVersion.objects.filter(pk=stamp).update(version=F("version") + 1)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(name=stamp, version=1)
+    except IntegrityError:
+        DataVersion.objects.filter(pk=stamp).update(version=F("version") + 1)
+
+
+def bump(user_id, *names):
+    """
+    Increment the version stamps of the given kinds of data of a user, or
+    of every user when `user_id` is None.
+
+    Every user has stamps of their own, counted again in the shard of the
+    user, so concurrent writes for different users seldom wait on the lock
+    of a shared row. Call it in the transaction of the change, so the new
+    version becomes visible together with the changed rows.
+    """
+    for name in names:
+        _increment(stamp_name(name, user_id))
+        if user_id is not None:
+            _increment(shard_name(name, int(user_id) % SHARDS))
+
+
+def _sum_stamps(stamps):
+    versions = dict.fromkeys(KINDS, 0)
+    for stamp, version in DataVersion.objects.filter(name__in=list(stamps)).values_list(
+        "name", "version"
+    ):
+        versions[stamps[stamp]] += version
+    return versions
+
+
+def current_versions(user_id=None):
+    """
+    Return the version of every kind of data, in one query on at most
+    `SHARDS + 1` rows per kind: the version of the data of a user when
+    `user_id` is given, else of all the data.
+
+    A version is the sum of the stamps it covers. Stamps are never deleted,
+    so it grows with every change to the data.
+    """
+    if user_id is None:
+        stamps = {stamp_name(name): name for name in KINDS}
+        stamps.update(
+            {shard_name(name, shard): name for name in KINDS for shard in range(SHARDS)}
+        )
+        return _sum_stamps(stamps)
+    return _sum_stamps(
+        {stamp_name(name, scope): name for name in KINDS for scope in (user_id, None)}
+    )
@@ -1,3 +1,399 @@
-from django.shortcuts import render
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.db import close_old_connections, connection, transaction
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotAllowed,
+    HttpResponseNotModified,
+)
+from graphene_django.settings import graphene_settings
+from graphene_django.views import MUTATION_ERRORS_FLAG, GraphQLView, HttpError
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast
+from graphql import validate_schema
+from graphql_jwt.utils import get_http_authorization
+from user_contracts import admission, metrics
+from user_contracts.api.loaders import get_loaders
+from user_contracts.documents import compile_document
+from user_contracts.http_cache import (
+    compute_etag,
+    etag_matches,
+    is_read_only,
+    patch_cache_headers,
+)
+from user_contracts.instrumentation import OperationStats, current_stats
+from user_contracts.metrics import registry
+from user_contracts.serialization import compress_response, dumps
+from user_contracts.slow_log import log_operation
 
-# Create your views here.
+# Set on requests whose response must not be cached.
+UNCACHEABLE_FLAG = "graphql_uncacheable"
+
+
+def batch_max_operations():
+    return getattr(settings, "GRAPHQL_BATCH_MAX_OPERATIONS", 20)
+
+
+def batch_concurrency():
+    return getattr(settings, "GRAPHQL_BATCH_CONCURRENCY", 1)
+
+
+def authenticate_once(request):
+    """
+    Authenticate the JWT of a request up front, so that the operations of a
+    batch share the user instead of each verifying the token.
+
+    An invalid token is left for the JWT middleware to report in the
+    response of each operation.
+    """
+    if get_http_authorization(request) is None:
+        return
+    if hasattr(request, "user") and not request.user.is_anonymous:
+        return
+    try:
+        user = authenticate(request=request)
+    except Exception:
+        return
+    if user is not None:
+        request.user = user
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(workers):
+    """
+    Thread pool of `workers` threads shared by the batches of the process.
+    It is created on the first batch, so in the worker processes rather
+    than in the master they are forked from.
+    """
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="graphql-batch"
+            )
+        return _executors[workers]
+
+
+def run_concurrently(func, items, workers):
+    """
+    Call `func` on every item on the pool of `workers` threads and return
+    the results in the order of the items.
+
+    Each call is handled like a request: the database connection of the
+    thread is closed before and after it when it is unusable or older than
+    `CONN_MAX_AGE`, and kept for the next call otherwise.
+    """
+
+    def call(item):
+        close_old_connections()
+        try:
+            return func(item)
+        finally:
+            close_old_connections()
+
+    return list(get_executor(workers).map(call, items))
+
+
+class ContractsGraphQLView(GraphQLView):
+    """
+    GraphQL view of the API.
+
+    Every operation is measured: its latency, the number of SQL queries it
+    issued and their time are recorded per operation name and exposed by
+    `metrics_view`. Slow operations are written to the slow-operation log.
+
+    Results are encoded with the fast serializer of
+    `user_contracts.serialization` and large responses are streamed
+    compressed to the clients accepting it.
+
+    Queries sent over GET get an ETag derived from the data version stamps
+    and are answered with 304 Not Modified, without running them, when the
+    client already has the current response.
+
+    A POST of a JSON array runs each of its operations and answers with the
+    array of their results. The operations share the request as context,
+    and so the authenticated user and the loaders; when they are all
+    queries they can run concurrently (see `GRAPHQL_BATCH_CONCURRENCY`).
+
+    Requests go through the admission control first: requests beyond the
+    concurrency limit are shed with 429 Too Many Requests instead of
+    waiting for a worker, and the others charge the estimated cost of
+    their operations to the token bucket of their client. The concurrency
+    is checked first so that shed requests do not spend tokens.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with admission.concurrency_slot() as admitted:
+            if not admitted:
+                return admission.rejection(
+                    admission.OVERLOADED, 1, "The server is overloaded."
+                )
+            rejection = admission.check_rate_limit(
+                request, self.get_request_cost(request)
+            )
+            if rejection is not None:
+                return rejection
+            return self.dispatch_admitted(request, *args, **kwargs)
+
+    def dispatch_admitted(self, request, *args, **kwargs):
+        if self.is_batch_request(request):
+            return compress_response(request, self.dispatch_batch(request))
+
+        etag = self.get_etag(request)
+        if etag is not None and etag_matches(request, etag):
+            return patch_cache_headers(request, HttpResponseNotModified(), etag)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if (
+            etag is not None
+            and response.status_code == 200
+            and not getattr(request, UNCACHEABLE_FLAG, False)
+        ):
+            patch_cache_headers(request, response, etag)
+        return compress_response(request, response)
+
+    def get_request_cost(self, request):
+        """Estimated cost of the operations of a request, at least 1."""
+        if self.is_batch_request(request):
+            try:
+                entries = json.loads(request.body.decode("utf-8"))
+            except (TypeError, ValueError):
+                return 1
+            if not isinstance(entries, list):
+                return 1
+            return max(
+                1,
+                sum(
+                    admission.operation_cost(
+                        entry.get("query"), entry.get("operationName")
+                    )
+                    for entry in entries[: batch_max_operations()]
+                    if isinstance(entry, dict)
+                ),
+            )
+        try:
+            data = self.parse_body(request)
+            query, _, operation_name, _ = self.get_graphql_params(request, data)
+        except HttpError:
+            return 1
+        return admission.operation_cost(query, operation_name)
+
+    def is_batch_request(self, request):
+        return (
+            request.method == "POST"
+            and self.get_content_type(request) == "application/json"
+            and request.body.lstrip()[:1] == b"["
+        )
+
+    def parse_batch(self, request):
+        try:
+            entries = json.loads(request.body.decode("utf-8"))
+        except (TypeError, ValueError):
+            raise HttpError(HttpResponseBadRequest("POST body sent invalid JSON."))
+        if not entries:
+            raise HttpError(
+                HttpResponseBadRequest("Received an empty list in the batch request.")
+            )
+        if len(entries) > batch_max_operations():
+            raise HttpError(
+                HttpResponseBadRequest(
+                    f"A batch can hold at most {batch_max_operations()} operations."
+                )
+            )
+        if not all(isinstance(entry, dict) for entry in entries):
+            raise HttpError(
+                HttpResponseBadRequest("Every operation of a batch must be an object.")
+            )
+        return entries
+
+    def dispatch_batch(self, request):
+        try:
+            entries = self.parse_batch(request)
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+            return response
+
+        authenticate_once(request)
+        get_loaders(request)
+
+        workers = batch_concurrency()
+        if (
+            workers > 1
+            and len(entries) > 1
+            and all(
+                entry.get("query")
+                and is_read_only(entry["query"], entry.get("operationName"))
+                for entry in entries
+            )
+        ):
+            results = run_concurrently(
+                lambda entry: self.get_batch_entry_response(request, entry),
+                entries,
+                workers,
+            )
+        else:
+            results = [self.get_batch_entry_response(request, e) for e in entries]
+
+        return HttpResponse(
+            b"[" + b",".join(dumps(result) for result in results) + b"]",
+            status=max(result["status"] for result in results),
+            content_type="application/json",
+        )
+
+    def get_batch_entry_response(self, request, entry):
+        """Run one operation of a batch and return its result."""
+        try:
+            query, variables, operation_name, id = self.get_graphql_params(
+                request, entry
+            )
+            execution_result = self.execute_graphql_request(
+                request, entry, query, variables, operation_name
+            )
+        except HttpError as e:
+            return {
+                "id": entry.get("id"),
+                "status": e.response.status_code,
+                "errors": [self.format_error(e)],
+            }
+
+        response = {"id": id, "status": 200}
+        if execution_result.errors:
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.errors and any(
+            not getattr(e, "path", None) for e in execution_result.errors
+        ):
+            response["status"] = 400
+        else:
+            response["data"] = execution_result.data
+        return response
+
+    def get_etag(self, request):
+        """Return the ETag of a cacheable GET query, None for other requests."""
+        if request.method != "GET":
+            return None
+        if self.graphiql and self.can_display_graphiql(request, {}):
+            return None
+        try:
+            query, variables, operation_name, _ = self.get_graphql_params(request, {})
+        except HttpError:
+            return None
+        if not query or not is_read_only(query, operation_name):
+            return None
+        return compute_etag(request, query, variables, operation_name)
+
+    def json_encode(self, request, d, pretty=False):
+        if self.pretty or pretty or request.GET.get("pretty") or self.batch:
+            return super().json_encode(request, d, pretty)
+        return dumps(d)
+
+    def execute_compiled(
+        self, request, query, variables, operation_name, show_graphiql=False
+    ):
+        """
+        `GraphQLView.execute_graphql_request`, with the documents parsed and
+        validated once by `compile_document` instead of on every request.
+        """
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        rules = self.validation_rules
+        document, errors = compile_document(
+            schema, query, tuple(rules) if rules is not None else None
+        )
+        if document is None:
+            return ExecutionResult(errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = (
+                    self.execution_context_class
+                )
+            if (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+            return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        stats = OperationStats(operation_name)
+        token = current_stats.set(stats)
+        result = None
+        try:
+            with connection.execute_wrapper(stats.execute_wrapper):
+                result = self.execute_compiled(
+                    request, query, variables, operation_name, show_graphiql
+                )
+            if result is None or result.errors:
+                setattr(request, UNCACHEABLE_FLAG, True)
+            return result
+        finally:
+            current_stats.reset(token)
+            if query:
+                stats.finish(result)
+                log_operation(stats, query, variables)
+
+
+def metrics_view(request):
+    """
+    Expose the collected metrics in the Prometheus text format: those of
+    every worker process with `METRICS_DIR`, else those of this one.
+    """
+    return HttpResponse(
+        registry.render(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
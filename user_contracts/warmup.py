@@ -0,0 +1,118 @@
+import gc
+import logging
+import random
+import time
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.urls import get_resolver
+from graphql import validate_schema
+from user_contracts import metrics
+from user_contracts.admission import operation_cost
+from user_contracts.api.operations import OPERATIONS
+from user_contracts.documents import compile_document
+from user_contracts.http_cache import is_read_only
+from user_contracts.metrics import registry
+
+STARTUP_PHASE_SECONDS = registry.gauge(
+    "startup_phase_seconds",
+    "Seconds spent by each phase of the warm-up before the workers fork.",
+    ["phase"],
+)
+WORKER_STARTUP_SECONDS = registry.gauge(
+    "worker_startup_seconds",
+    "Seconds from the fork of this worker until it was ready.",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _phase(name, function, timings):
+    start = time.perf_counter()
+    function()
+    timings[name] = time.perf_counter() - start
+    STARTUP_PHASE_SECONDS.set((name,), timings[name])
+
+
+def build_schema():
+    from user_contracts.api.schema import schema
+
+    errors = validate_schema(schema.graphql_schema)
+    if errors:
+        raise RuntimeError(f"Invalid GraphQL schema: {errors}")
+    return schema
+
+
+def compile_operations():
+    """Compile the documents of the known operations as the view would."""
+    from user_contracts.views import ContractsGraphQLView
+
+    schema = build_schema().graphql_schema
+    rules = ContractsGraphQLView.validation_rules
+    for operation in OPERATIONS.values():
+        compile_document(
+            schema, operation.document, tuple(rules) if rules is not None else None
+        )
+        operation_cost(operation.document)
+        operation_cost(operation.document, operation.name)
+        is_read_only(operation.document)
+        is_read_only(operation.document, operation.name)
+
+
+def check_database():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    executor = MigrationExecutor(connection)
+    unapplied = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    if unapplied:
+        logger.warning("%d migrations are not applied.", len(unapplied))
+    if not keeps_connections() and connection.vendor != "sqlite":
+        logger.warning(
+            "CONN_MAX_AGE is 0: each request opens a new database connection."
+        )
+
+
+def keeps_connections():
+    """Whether connections outlive the request that opened them."""
+    return connection.settings_dict["CONN_MAX_AGE"] != 0
+
+
+def warm_up():
+    """
+    Do the work every worker would otherwise repeat on its first requests:
+    import and validate the schema, compile the documents of the known
+    operations, load the URL patterns and check the database.
+
+    Meant to run once in the master process before the workers fork, so
+    they start with all of it in memory. The database connections are
+    closed afterwards, a connection must not be shared across processes,
+    and the objects created so far are frozen out of the garbage
+    collector, so collections in the workers do not touch their pages
+    and the memory stays shared. Returns the seconds spent per phase.
+    """
+    timings = {}
+    _phase("schema", build_schema, timings)
+    _phase("documents", compile_operations, timings)
+    _phase("urls", lambda: get_resolver().url_patterns, timings)
+    _phase("database", check_database, timings)
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+    return timings
+
+
+def after_fork(forked_at=None):
+    """
+    Prepare a freshly forked worker: reseed the random generator, which the
+    worker inherited from the master, open its database connection now
+    rather than on its first request, and write its metrics for /metrics.
+    `forked_at` is the `time.time()` the master forked the worker at.
+
+    With a `CONN_MAX_AGE` of 0 the connection would be closed when the
+    first request starts, so it is left to that request.
+    """
+    random.seed()
+    if keeps_connections():
+        connection.ensure_connection()
+    if forked_at is not None:
+        WORKER_STARTUP_SECONDS.set(value=time.time() - forked_at)
+    metrics.start_flushing()